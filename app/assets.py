@@ -0,0 +1,357 @@
+"""
+Local mirror of generated outputs.
+
+Upstream output URLs expire, so finished outputs are downloaded into a
+content-addressed directory (each file is named after the SHA-256 of its
+bytes) and served from our own endpoint. Downloads are streamed to disk in
+chunks, so large videos are never held in memory. The total size of the
+store is bounded; the least recently served files are evicted first.
+"""
+
+import os
+import re
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+import mimetypes
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Mapping, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiofiles
+import httpx
+from starlette.responses import Response, StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+ASSET_MIRROR_ENABLED = os.getenv("ASSET_MIRROR_ENABLED", "true").lower() == "true"
+ASSET_DIR = os.getenv("ASSET_DIR", "output/assets")
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_BYTES", 10 * 1024 ** 3))
+ASSET_CHUNK_SIZE = int(os.getenv("ASSET_CHUNK_SIZE", 1024 * 1024))
+ASSET_DOWNLOAD_TIMEOUT = float(os.getenv("ASSET_DOWNLOAD_TIMEOUT", 300))
+
+ASSET_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+_EXTENSION = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+class AssetTooLargeError(Exception):
+    """Raised when a download would not fit in the store."""
+
+
+class RangeNotSatisfiableError(ValueError):
+    """Raised for a ``Range`` header that selects no bytes of the file."""
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range`` header into inclusive (start, end) offsets.
+
+    Returns None when the whole file should be sent (no header, a syntax we
+    do not handle, or several ranges).
+
+    Raises:
+        RangeNotSatisfiableError: If the range lies outside the file
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiableError(header)
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableError(header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def _http_date(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _output_extension(url: str, content_type: Optional[str]) -> str:
+    extension = os.path.splitext(urlparse(url).path)[1].lower()
+    if _EXTENSION.match(extension):
+        return extension
+    if content_type:
+        return mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return ""
+
+
+class AssetStore:
+    """
+    Content-addressed, size-bounded store of downloaded outputs.
+
+    Args:
+        root: Directory holding the files (fanned out by the first two hex digits)
+        max_bytes: Total size kept before least recently used files are evicted
+        chunk_size: Bytes read from the network and written to disk at a time
+        timeout: Seconds allowed for one download
+    """
+
+    def __init__(self, root: str = ASSET_DIR, max_bytes: int = ASSET_MAX_BYTES,
+                 chunk_size: int = ASSET_CHUNK_SIZE, timeout: float = ASSET_DOWNLOAD_TIMEOUT):
+        self._root = root
+        self._tmp_dir = os.path.join(root, "tmp")
+        self._max_bytes = max_bytes
+        self._chunk_size = chunk_size
+        self._timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+        # name -> size in bytes, least recently used first
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._downloads: Dict[str, asyncio.Task] = {}
+        self._downloaded = 0
+        self._downloaded_bytes = 0
+        self._failed = 0
+        self._served = 0
+        self._evicted = 0
+
+    # --- Lifecycle ---
+
+    async def open(self):
+        files = await asyncio.to_thread(self._scan)
+        for name, size in files:
+            self._files[name] = size
+            self._bytes += size
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self._timeout, connect=10),
+            follow_redirects=True
+        )
+        logger.info(f"Asset store opened at {self._root} ({len(self._files)} files, {self._bytes} bytes)")
+        await self._evict()
+
+    def _scan(self) -> List[Tuple[str, int]]:
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        # Partial downloads from a previous run
+        for entry in os.scandir(self._tmp_dir):
+            os.unlink(entry.path)
+        found = []
+        for directory in os.scandir(self._root):
+            if not directory.is_dir() or directory.path == self._tmp_dir:
+                continue
+            for entry in os.scandir(directory.path):
+                if ASSET_NAME.match(entry.name):
+                    stat = entry.stat()
+                    found.append((stat.st_atime, entry.name, stat.st_size))
+        # Access times are kept up to date on every serve, so they give the LRU order
+        return [(name, size) for _, name, size in sorted(found)]
+
+    async def close(self):
+        for task in self._downloads.values():
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # --- Files ---
+
+    @property
+    def tmp_dir(self) -> str:
+        """Scratch directory on the same filesystem, for files later passed to ``add``."""
+        return self._tmp_dir
+
+    def path(self, name: str) -> str:
+        return os.path.join(self._root, name[:2], name)
+
+    def has(self, name: str) -> bool:
+        return name in self._files
+
+    async def mirror(self, url: str) -> str:
+        """Download ``url`` into the store (once, however many callers ask) and return its name."""
+        task = self._downloads.get(url)
+        if task is None:
+            task = asyncio.create_task(self._download(url))
+            self._downloads[url] = task
+            task.add_done_callback(lambda _: self._downloads.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def _download(self, url: str) -> str:
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        started = time.monotonic()
+        try:
+            async with aiofiles.open(fd, "wb") as f:
+                async with self._client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    length = response.headers.get("content-length")
+                    if length and int(length) > self._max_bytes:
+                        raise AssetTooLargeError(f"{url} is {length} bytes (store limit {self._max_bytes})")
+                    async for chunk in response.aiter_bytes(self._chunk_size):
+                        size += len(chunk)
+                        if size > self._max_bytes:
+                            raise AssetTooLargeError(f"{url} exceeds the store limit of {self._max_bytes} bytes")
+                        digest.update(chunk)
+                        await f.write(chunk)
+                    extension = _output_extension(url, response.headers.get("content-type"))
+            name = digest.hexdigest() + extension
+            await asyncio.to_thread(self._commit, tmp_path, name)
+        except BaseException:
+            self._failed += 1
+            await asyncio.to_thread(self._discard, tmp_path)
+            raise
+        self._downloaded += 1
+        self._downloaded_bytes += size
+        logger.info(f"Mirrored {url} as {name} ({size} bytes in {time.monotonic() - started:.2f}s)")
+        await self._index(name, size)
+        return name
+
+    async def add(self, tmp_path: str, name: str, size: int) -> str:
+        """Move a finished file from ``tmp_dir`` into the store under ``name`` (its content hash)."""
+        try:
+            await asyncio.to_thread(self._commit, tmp_path, name)
+        except BaseException:
+            await asyncio.to_thread(self._discard, tmp_path)
+            raise
+        await self._index(name, size)
+        return name
+
+    async def _index(self, name: str, size: int):
+        if name not in self._files:
+            self._bytes += size
+        self._files[name] = size
+        self._files.move_to_end(name)
+        await self._evict(keep=name)
+
+    def _commit(self, tmp_path: str, name: str):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        os.replace(tmp_path, self.path(name))
+
+    @staticmethod
+    def _discard(tmp_path: str):
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def _evict(self, keep: Optional[str] = None):
+        victims = []
+        while self._bytes > self._max_bytes and self._files:
+            name, size = next(iter(self._files.items()))
+            if name == keep:
+                break
+            del self._files[name]
+            self._bytes -= size
+            victims.append(name)
+        if victims:
+            self._evicted += len(victims)
+            await asyncio.to_thread(self._unlink, victims)
+            logger.info(f"Evicted {len(victims)} least recently used assets")
+
+    def _unlink(self, names: List[str]):
+        for name in names:
+            try:
+                os.unlink(self.path(name))
+            except FileNotFoundError:
+                pass
+
+    async def open_asset(self, name: str) -> Optional[os.stat_result]:
+        """Mark ``name`` as just used and return its stat, or None if it is not stored."""
+        if name not in self._files:
+            return None
+        try:
+            stat = await asyncio.to_thread(self._touch, self.path(name))
+        except FileNotFoundError:
+            self._bytes -= self._files.pop(name, 0)
+            return None
+        if name in self._files:
+            self._files.move_to_end(name)
+        self._served += 1
+        return stat
+
+    @staticmethod
+    def _touch(path: str) -> os.stat_result:
+        stat = os.stat(path)
+        os.utime(path, (time.time(), stat.st_mtime))
+        return stat
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self._files),
+            "bytes": self._bytes,
+            "maxBytes": self._max_bytes,
+            "downloading": len(self._downloads),
+            "downloaded": self._downloaded,
+            "downloadedBytes": self._downloaded_bytes,
+            "failed": self._failed,
+            "served": self._served,
+            "evicted": self._evicted,
+        }
+
+    # --- Serving ---
+
+    def response(self, name: str, stat: os.stat_result, method: str, headers: Mapping[str, str]) -> Response:
+        """
+        HTTP response for a stored file, honouring conditional and range requests.
+
+        The ETag is the content hash, so it never changes for a given name.
+        """
+        etag = f'"{name.split(".")[0]}"'
+        size = stat.st_size
+        response_headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "Accept-Ranges": "bytes",
+        }
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            if _etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers=response_headers)
+        else:
+            since = _http_date(headers.get("if-modified-since", ""))
+            if since is not None and int(stat.st_mtime) <= since:
+                return Response(status_code=304, headers=response_headers)
+
+        byte_range = None
+        if_range = headers.get("if-range")
+        if if_range is None or if_range.strip() == etag or (_http_date(if_range) or 0) >= int(stat.st_mtime):
+            try:
+                byte_range = parse_range(headers.get("range"), size)
+            except RangeNotSatisfiableError:
+                response_headers["Content-Range"] = f"bytes */{size}"
+                return Response(status_code=416, headers=response_headers)
+
+        status_code = 200
+        start, end = 0, size - 1
+        if byte_range is not None:
+            status_code = 206
+            start, end = byte_range
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response_headers["Content-Length"] = str(end - start + 1)
+        if method == "HEAD":
+            return Response(status_code=status_code, headers=response_headers, media_type=media_type)
+        return StreamingResponse(self._read(name, start, end), status_code=status_code,
+                                 headers=response_headers, media_type=media_type)
+
+    async def _read(self, name: str, start: int, end: int):
+        remaining = end - start + 1
+        async with aiofiles.open(self.path(name), "rb") as f:
+            await f.seek(start)
+            while remaining > 0:
+                chunk = await f.read(min(self._chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
@@ -0,0 +1,302 @@
+"""
+Generation backends.
+
+A backend knows which model identifier to use for each kind of output and
+how to run a prediction. ``GENERATION_BACKEND`` selects one:
+
+- ``replicate`` (default): calls the Replicate API
+- ``fake``: a local stand-in with configurable latency, failure rate and
+  output URLs, for load-testing without network access or spend
+
+Backends also classify their errors (``classify_error``) so the executor
+knows which failures to retry and which mean the upstream is throttling us,
+and stop a prediction early when its ``cancelled`` event is set.
+"""
+
+import os
+import re
+import math
+import uuid
+import random
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+from app.resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "replicate")
+
+IMAGE_MODEL = os.getenv(
+    "IMAGE_MODEL",
+    "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b"
+)
+VIDEO_MODEL = os.getenv(
+    "VIDEO_MODEL",
+    "tencent/hunyuan-video:6c9132aee14409cd6568d030453f1ba50f5f3412b844fe67f78a9eb62d55664f"
+)
+
+FAKE_IMAGE_LATENCY = os.getenv("FAKE_IMAGE_LATENCY", "lognormal:3:0.3")
+FAKE_VIDEO_LATENCY = os.getenv("FAKE_VIDEO_LATENCY", "lognormal:60:0.3")
+FAKE_FAILURE_RATE = float(os.getenv("FAKE_FAILURE_RATE", 0))
+FAKE_EMPTY_RATE = float(os.getenv("FAKE_EMPTY_RATE", 0))
+FAKE_THROTTLE_RATE = float(os.getenv("FAKE_THROTTLE_RATE", 0))
+# Placeholder host of fake outputs; nothing can be downloaded from it
+_FAKE_PLACEHOLDER_URL = "https://fake.replicate.local"
+FAKE_OUTPUT_BASE_URL = os.getenv("FAKE_OUTPUT_BASE_URL", _FAKE_PLACEHOLDER_URL)
+# Consecutive failed status polls of a created prediction before giving up on it
+REPLICATE_POLL_RETRIES = int(os.getenv("REPLICATE_POLL_RETRIES", 5))
+
+# Error classes returned by GenerationBackend.classify_error
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status code carried by an exception, if any."""
+    for attribute in ("status", "status_code"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+class GenerationBackend:
+    """
+    Interface for running predictions.
+
+    ``run`` is synchronous; the executor calls it from its thread pool and
+    sets ``cancelled`` when the caller no longer wants the result.
+    """
+
+    name = "base"
+    # Whether output URLs can be downloaded (and so mirrored into the asset store)
+    downloadable_outputs = True
+
+    def __init__(self, image_model: str = IMAGE_MODEL, video_model: str = VIDEO_MODEL):
+        self.models = {"image": image_model, "video": video_model}
+
+    def configuration_error(self) -> Optional[str]:
+        """Return a message if the backend cannot run in this environment."""
+        return None
+
+    def prepare(self):
+        """
+        Load anything slow to import ahead of the first prediction.
+
+        Called on a worker thread after the server has started, so the SDK
+        import neither delays startup nor stalls the first request.
+        """
+
+    def run(self, model: str, input: Dict[str, Any], cancelled: Optional[threading.Event] = None) -> Any:
+        """
+        Run one prediction and return its output (a URL or list of URLs).
+
+        Raises:
+            PredictionCancelledError: If ``cancelled`` was set before the
+                prediction finished
+        """
+        raise NotImplementedError
+
+    def classify_error(self, error: BaseException) -> str:
+        """
+        Classify an exception raised by ``run``.
+
+        Returns:
+            THROTTLED for rate limiting, TRANSIENT for failures worth
+            retrying (timeouts, connection errors, 5xx), otherwise PERMANENT
+        """
+        status = error_status(error)
+        if status == 429:
+            return THROTTLED
+        if status is not None:
+            return TRANSIENT if status == 408 or status >= 500 else PERMANENT
+        if isinstance(error, (TimeoutError, ConnectionError, httpx.TransportError)):
+            return TRANSIENT
+        return PERMANENT
+
+
+class ReplicateBackend(GenerationBackend):
+    name = "replicate"
+
+    def configuration_error(self) -> Optional[str]:
+        if not os.getenv("REPLICATE_API_TOKEN"):
+            return "REPLICATE_API_TOKEN not found in environment variables"
+        return None
+
+    def prepare(self):
+        import replicate  # noqa: F401
+
+    # ReplicateError only carries the API's ``detail`` message, not the status
+    _THROTTLE_MESSAGE = re.compile(r"throttled|rate limit|too many requests", re.IGNORECASE)
+    _CLIENT_ERROR_MESSAGE = re.compile(
+        r"invalid|not found|does not exist|unauthenticated|authentication|permission|payment|billing",
+        re.IGNORECASE
+    )
+
+    def run(self, model: str, input: Dict[str, Any], cancelled: Optional[threading.Event] = None) -> Any:
+        # Same as replicate.run, but polled here so the prediction can be cancelled
+        import replicate
+        from replicate.exceptions import ModelError
+        name, _, version = model.partition(":")
+        if version:
+            prediction = replicate.predictions.create(version=version, input=input)
+        else:
+            prediction = replicate.models.predictions.create(model=name, input=input)
+        # From here on the prediction is running (and billed): poll failures are
+        # retried against it, never by creating another one
+        cancelled = cancelled or threading.Event()
+        delay = replicate.default_client.poll_interval
+        failures = 0
+        while prediction.status not in ("succeeded", "failed", "canceled"):
+            if cancelled.wait(delay):
+                self._cancel(prediction)
+                raise PredictionCancelledError(f"Prediction {prediction.id} cancelled")
+            try:
+                prediction.reload()
+            except Exception as e:
+                failures += 1
+                if self.classify_error(e) == PERMANENT or failures > REPLICATE_POLL_RETRIES:
+                    logger.error(f"Giving up on prediction {prediction.id} after {failures} failed polls: {e}")
+                    self._cancel(prediction)
+                    raise
+                delay = max(replicate.default_client.poll_interval, backoff_delay(failures))
+                logger.warning(f"Polling prediction {prediction.id} failed ({e}); "
+                               f"retry {failures}/{REPLICATE_POLL_RETRIES} in {delay:.2f}s")
+                continue
+            failures = 0
+            delay = replicate.default_client.poll_interval
+        if prediction.status == "failed":
+            raise ModelError(prediction.error)
+        if prediction.status == "canceled":
+            raise PredictionCancelledError(f"Prediction {prediction.id} was cancelled upstream")
+        return prediction.output
+
+    @staticmethod
+    def _cancel(prediction):
+        try:
+            prediction.cancel()
+        except Exception as e:
+            logger.warning(f"Could not cancel prediction {prediction.id}: {e}")
+
+    def classify_error(self, error: BaseException) -> str:
+        from replicate.exceptions import ModelError, ReplicateError
+        if isinstance(error, ModelError):
+            # The prediction itself failed; running it again will not help
+            return PERMANENT
+        if isinstance(error, ReplicateError) and error_status(error) is None:
+            message = str(error)
+            if self._THROTTLE_MESSAGE.search(message):
+                return THROTTLED
+            if self._CLIENT_ERROR_MESSAGE.search(message):
+                return PERMANENT
+            return TRANSIENT
+        return super().classify_error(error)
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """
+    Build a latency sampler (seconds) from a spec string.
+
+    Supported forms: ``fixed:S``, ``uniform:MIN:MAX``, ``normal:MEAN:STD``
+    and ``lognormal:MEDIAN:SIGMA``, all in seconds.
+    """
+    kind, *args = spec.split(":")
+    values = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class PredictionCancelledError(Exception):
+    """Raised by ``run`` when a prediction is stopped through its ``cancelled`` event."""
+
+
+class FakeBackendError(Exception):
+    """Simulated upstream failure raised by FakeBackend."""
+
+    def __init__(self, message: str, status: int = 503):
+        super().__init__(message)
+        self.status = status
+
+
+class FakeBackend(GenerationBackend):
+    """
+    Offline stand-in for Replicate.
+
+    Args:
+        image_latency: Latency spec for image predictions (see parse_latency)
+        video_latency: Latency spec for video predictions
+        failure_rate: Probability (0-1) that a prediction raises a 503
+        empty_rate: Probability (0-1) that a prediction returns no output
+        throttle_rate: Probability (0-1) that a prediction is rejected with a
+            429 straight away, without the prediction latency
+        base_url: Prefix for the generated output URLs
+    """
+
+    name = "fake"
+
+    def __init__(self,
+                 image_latency: str = FAKE_IMAGE_LATENCY,
+                 video_latency: str = FAKE_VIDEO_LATENCY,
+                 failure_rate: float = FAKE_FAILURE_RATE,
+                 empty_rate: float = FAKE_EMPTY_RATE,
+                 throttle_rate: float = FAKE_THROTTLE_RATE,
+                 base_url: str = FAKE_OUTPUT_BASE_URL,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self._latency = {
+            self.models["image"]: parse_latency(image_latency),
+            self.models["video"]: parse_latency(video_latency),
+        }
+        self._extension = {self.models["image"]: "png", self.models["video"]: "mp4"}
+        self._failure_rate = failure_rate
+        self._empty_rate = empty_rate
+        self._throttle_rate = throttle_rate
+        self._base_url = base_url.rstrip("/")
+        # A custom base URL may point at a real file server to exercise mirroring
+        self.downloadable_outputs = self._base_url != _FAKE_PLACEHOLDER_URL
+
+    def run(self, model: str, input: Dict[str, Any], cancelled: Optional[threading.Event] = None) -> Any:
+        if random.random() < self._throttle_rate:
+            raise FakeBackendError("Simulated rate limit", status=429)
+        if (cancelled or threading.Event()).wait(self._latency[model]()):
+            raise PredictionCancelledError("Simulated prediction cancelled")
+        roll = random.random()
+        if roll < self._failure_rate:
+            raise FakeBackendError("Simulated upstream failure")
+        if roll < self._failure_rate + self._empty_rate:
+            return []
+        extension = self._extension[model]
+        return [
+            f"{self._base_url}/{uuid.uuid4().hex}.{extension}"
+            for _ in range(int(input.get("num_outputs", 1)))
+        ]
+
+
+BACKENDS = {
+    ReplicateBackend.name: ReplicateBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+
+def create_backend(name: str = GENERATION_BACKEND) -> GenerationBackend:
+    try:
+        backend = BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown GENERATION_BACKEND '{name}' (expected one of: {', '.join(BACKENDS)})")
+    logger.info(f"Using '{backend.name}' generation backend")
+    return backend
@@ -0,0 +1,129 @@
+"""
+Micro-batching of model calls that support multiple outputs.
+
+Requests with identical model input that arrive within a short window are
+merged into a single prediction with ``num_outputs`` set to the batch size,
+and each caller receives one of the outputs.
+"""
+
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BATCH_WINDOW_MS = float(os.getenv("IMAGE_BATCH_WINDOW_MS", 0))
+# SDXL on Replicate accepts at most 4 outputs per prediction
+IMAGE_BATCH_MAX = int(os.getenv("IMAGE_BATCH_MAX", 4))
+
+
+class _Batch:
+    def __init__(self, input: Dict[str, Any]):
+        self.input = input
+        self.futures: List[asyncio.Future] = []
+        self.on_start: List[Callable[[float], Any]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+
+
+class MicroBatcher:
+    """
+    Collects identical requests for ``window`` seconds and runs them as one.
+
+    Args:
+        run_batch: Async function called with (input, size, on_start); must
+            return a list of at least ``size`` outputs
+        window: Seconds to wait for more requests after the first one
+        max_size: Flush as soon as a batch reaches this many requests
+    """
+
+    def __init__(self, run_batch: Callable[..., Awaitable[Any]],
+                 window: float = IMAGE_BATCH_WINDOW_MS / 1000, max_size: int = IMAGE_BATCH_MAX):
+        self._run_batch = run_batch
+        self._window = window
+        self._max_size = max_size
+        self._pending: Dict[str, _Batch] = {}
+        self._flushing: Set[asyncio.Task] = set()
+        self._batches = 0
+        self._requests = 0
+
+    async def submit(self, input: Dict[str, Any],
+                     on_start: Optional[Callable[[float], Any]] = None) -> Any:
+        """Queue one request and return its single output (or None)."""
+        key = json.dumps(input, sort_keys=True)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = _Batch(input)
+            self._pending[key] = batch
+            batch.timer = asyncio.get_running_loop().call_later(self._window, self._close, key, batch)
+        future = asyncio.get_running_loop().create_future()
+        batch.futures.append(future)
+        if on_start:
+            batch.on_start.append(on_start)
+        if len(batch.futures) >= self._max_size:
+            batch.timer.cancel()
+            self._close(key, batch)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self._withdraw(key, batch, future, on_start)
+            raise
+
+    def _withdraw(self, key: str, batch: _Batch, future: asyncio.Future,
+                  on_start: Optional[Callable[[float], Any]]):
+        """Drop a cancelled request; cancel the prediction if nobody else wants it."""
+        if self._pending.get(key) is batch:
+            batch.futures.remove(future)
+            if on_start in batch.on_start:
+                batch.on_start.remove(on_start)
+            if not batch.futures:
+                batch.timer.cancel()
+                del self._pending[key]
+        elif batch.task is not None and all(f.done() for f in batch.futures):
+            batch.task.cancel()
+
+    def _close(self, key: str, batch: _Batch):
+        # Stop accepting requests into this batch before it starts running
+        if self._pending.get(key) is batch:
+            del self._pending[key]
+            task = asyncio.create_task(self._flush(batch))
+            batch.task = task
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: _Batch):
+        size = len(batch.futures)
+        self._batches += 1
+        self._requests += size
+
+        async def started(waited: float):
+            for callback in batch.on_start:
+                result = callback(waited)
+                if asyncio.iscoroutine(result):
+                    await result
+
+        try:
+            output = await self._run_batch(batch.input, size, started)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        outputs = output if isinstance(output, list) else [output] if output else []
+        if size > 1:
+            logger.info(f"Batched {size} requests into one prediction ({len(outputs)} outputs)")
+        for i, future in enumerate(batch.futures):
+            if not future.done():
+                future.set_result(outputs[i] if i < len(outputs) else None)
+
+    def stats(self) -> dict:
+        return {
+            "windowMs": self._window * 1000,
+            "maxSize": self._max_size,
+            "batches": self._batches,
+            "requests": self._requests,
+            "avgBatchSize": round(self._requests / self._batches, 2) if self._batches else 0.0,
+            "pending": sum(len(b.futures) for b in self._pending.values()),
+        }
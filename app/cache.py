@@ -0,0 +1,180 @@
+"""
+Content-addressed cache of generation results.
+
+Results are keyed by model version, normalized prompt and generation
+parameters. Lookups hit an in-memory LRU first and fall back to an SQLite
+index on disk, so repeated prompts survive restarts without another
+upstream run.
+"""
+
+import os
+import time
+import json
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", 3600))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "output/result_cache.sqlite3")
+RESULT_CACHE_DISK_SIZE = int(os.getenv("RESULT_CACHE_DISK_SIZE", 100000))
+
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+
+def cache_key(model: str, input: Dict[str, Any]) -> str:
+    """Stable hash of the model version and its (normalized) input."""
+    params = dict(input)
+    if isinstance(params.get("prompt"), str):
+        params["prompt"] = normalize_prompt(params["prompt"])
+    payload = json.dumps({"model": model, "input": params}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _DiskIndex:
+    """SQLite-backed key/value index with per-entry creation time."""
+
+    def __init__(self, path: str, max_entries: int):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+        self._conn.commit()
+        # Kept up to date by put/delete so stats never scan the table
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM results WHERE key = ?", (key,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, key: str, value: Any, created: float) -> int:
+        """Store an entry and return the number of old entries evicted."""
+        with self._lock:
+            existed = self._conn.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), created),
+            )
+            evicted = self._conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,),
+            ).rowcount
+            self._conn.commit()
+            self._entries += (not existed) - evicted
+        return evicted
+
+    def delete(self, key: str):
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM results WHERE key = ?", (key,)).rowcount
+            self._conn.commit()
+            self._entries -= deleted
+
+    def count(self) -> int:
+        """Number of entries, without touching the database."""
+        return self._entries
+
+
+class ResultCache:
+    """
+    Two-tier result cache: in-memory LRU with TTL over an on-disk index.
+
+    Args:
+        max_entries: Capacity of the in-memory tier
+        ttl: Seconds an entry stays valid in either tier
+        path: SQLite file for the disk tier, or None to disable it
+        max_disk_entries: Capacity of the disk tier
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 path: Optional[str] = RESULT_CACHE_PATH,
+                 max_disk_entries: int = RESULT_CACHE_DISK_SIZE):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._disk = None
+        if path:
+            try:
+                self._disk = _DiskIndex(path, max_disk_entries)
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"Result cache disk tier disabled: {e}")
+        self.counters = {
+            "memoryHits": 0,
+            "diskHits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "diskEvictions": 0,
+        }
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created = entry
+            if now - created < self._ttl:
+                self._memory.move_to_end(key)
+                self.counters["memoryHits"] += 1
+                return value
+            del self._memory[key]
+            self.counters["expirations"] += 1
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk.get, key)
+            if row is not None:
+                value, created = row
+                if now - created < self._ttl:
+                    self._remember(key, value, created)
+                    self.counters["diskHits"] += 1
+                    return value
+                await asyncio.to_thread(self._disk.delete, key)
+                self.counters["expirations"] += 1
+        self.counters["misses"] += 1
+        return None
+
+    async def put(self, key: str, value: Any):
+        created = time.time()
+        self._remember(key, value, created)
+        if self._disk is not None:
+            try:
+                evicted = await asyncio.to_thread(self._disk.put, key, value, created)
+                self.counters["diskEvictions"] += evicted
+            except sqlite3.Error as e:
+                logger.error(f"Result cache disk write failed: {e}")
+
+    def _remember(self, key: str, value: Any, created: float):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        hits = self.counters["memoryHits"] + self.counters["diskHits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+            "memoryEntries": len(self._memory),
+            "memoryCapacity": self._max_entries,
+            "diskEntries": self._disk.count() if self._disk is not None else 0,
+            "ttlSeconds": self._ttl,
+        }
@@ -0,0 +1,234 @@
+"""
+Derived versions of generated outputs.
+
+Once an output has been mirrored into the asset store, smaller variants are
+built from it for galleries and previews:
+
+- images: ``thumbnail`` (longest side THUMBNAIL_SIZE), a full-size ``webp``
+  and, where the installed Pillow supports it, an ``avif``
+- videos: a JPEG ``poster`` frame (needs ffmpeg) and a ``thumbnail`` of it
+
+Encoding is CPU-bound, so it runs in a process pool instead of on the event
+loop. Pillow is optional: without it no image variants are built and video
+posters are left as extracted by ffmpeg.
+"""
+
+import io
+import os
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_ENABLED = os.getenv("DERIVATIVES_ENABLED", "true").lower() == "true"
+# Worker processes for encoding; 0 means one per CPU
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", 0))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", 256))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", 80))
+AVIF_QUALITY = int(os.getenv("AVIF_QUALITY", 60))
+POSTER_QUALITY = int(os.getenv("POSTER_QUALITY", 85))
+# Seconds into the video to take the poster frame from
+POSTER_OFFSET = float(os.getenv("POSTER_OFFSET", 1))
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+
+class DerivativeOptions(NamedTuple):
+    thumbnail_size: int = THUMBNAIL_SIZE
+    webp_quality: int = WEBP_QUALITY
+    avif_quality: int = AVIF_QUALITY
+    poster_quality: int = POSTER_QUALITY
+    poster_offset: float = POSTER_OFFSET
+    ffmpeg: Optional[str] = None
+    pillow: bool = False
+    webp: bool = False
+    avif: bool = False
+
+
+def detect_options(ffmpeg_path: str = FFMPEG_PATH) -> Optional[DerivativeOptions]:
+    """Options for this environment, or None if no variant can be built at all."""
+    ffmpeg = shutil.which(ffmpeg_path)
+    try:
+        from PIL import features
+    except ImportError:
+        if ffmpeg is None:
+            return None
+        return DerivativeOptions(ffmpeg=ffmpeg)
+    try:
+        avif = bool(features.check("avif"))
+    except ValueError:
+        # Pillow before 11.2 has no built-in AVIF; the plugin adds it
+        try:
+            import pillow_avif  # noqa: F401
+            avif = True
+        except ImportError:
+            avif = False
+    return DerivativeOptions(ffmpeg=ffmpeg, pillow=True, webp=bool(features.check("webp")), avif=avif)
+
+
+# Variant name -> (temporary file, content-addressed name, size)
+BuiltFiles = Dict[str, Tuple[str, str, int]]
+
+
+def _write(tmp_dir: str, data: bytes, extension: str) -> Tuple[str, str, int]:
+    fd, path = tempfile.mkstemp(dir=tmp_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path, hashlib.sha256(data).hexdigest() + extension, len(data)
+
+
+def _encode(image, format: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return buffer.getvalue()
+
+
+def _thumbnail(image, tmp_dir: str, options: DerivativeOptions) -> Tuple[str, str, int]:
+    from PIL import Image
+    thumbnail = image.copy()
+    thumbnail.thumbnail((options.thumbnail_size, options.thumbnail_size), Image.LANCZOS)
+    if options.webp:
+        return _write(tmp_dir, _encode(thumbnail, "WEBP", quality=options.webp_quality), ".webp")
+    return _write(tmp_dir, _encode(thumbnail.convert("RGB"), "JPEG", quality=options.poster_quality), ".jpg")
+
+
+def build_image_variants(source: str, tmp_dir: str, options: DerivativeOptions) -> BuiltFiles:
+    """Process-pool task: encode the variants of one image into ``tmp_dir``."""
+    from PIL import Image
+    with Image.open(source) as image:
+        image.load()
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+    built = {"thumbnail": _thumbnail(image, tmp_dir, options)}
+    if options.webp:
+        built["webp"] = _write(tmp_dir, _encode(image, "WEBP", quality=options.webp_quality), ".webp")
+    if options.avif:
+        built["avif"] = _write(tmp_dir, _encode(image, "AVIF", quality=options.avif_quality), ".avif")
+    return built
+
+
+def _extract_frame(ffmpeg: str, source: str, offset: float) -> bytes:
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-ss", str(offset), "-i", source,
+         "-frames:v", "1", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "2", "pipe:1"],
+        capture_output=True, timeout=60
+    )
+    return result.stdout
+
+
+def build_video_variants(source: str, tmp_dir: str, options: DerivativeOptions) -> BuiltFiles:
+    """Process-pool task: extract a poster frame of one video and its thumbnail."""
+    frame = _extract_frame(options.ffmpeg, source, options.poster_offset)
+    if not frame and options.poster_offset > 0:
+        # Shorter than the offset
+        frame = _extract_frame(options.ffmpeg, source, 0)
+    if not frame:
+        raise RuntimeError(f"ffmpeg could not extract a frame from {source}")
+    try:
+        from PIL import Image
+    except ImportError:
+        return {"poster": _write(tmp_dir, frame, ".jpg")}
+    with Image.open(io.BytesIO(frame)) as image:
+        image = image.convert("RGB")
+    return {
+        "poster": _write(tmp_dir, _encode(image, "JPEG", quality=options.poster_quality), ".jpg"),
+        "thumbnail": _thumbnail(image, tmp_dir, options),
+    }
+
+
+class DerivativeBuilder:
+    """
+    Builds variants of stored assets in a process pool and adds them to the store.
+
+    Args:
+        assets: The AssetStore holding sources and receiving the variants
+        workers: Worker processes (0 for one per CPU)
+        options: Encoding settings; detected from the environment if omitted
+    """
+
+    def __init__(self, assets, workers: int = DERIVATIVE_WORKERS,
+                 options: Optional[DerivativeOptions] = None):
+        self._assets = assets
+        self._workers = workers or os.cpu_count() or 1
+        self._options = options
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._building = 0
+        self._built = 0
+        self._failed = 0
+        self._build_seconds = 0.0
+
+    def start(self):
+        if self._options is None:
+            self._options = detect_options()
+        if self._options is None:
+            logger.warning("Neither Pillow nor ffmpeg is available; no image or video variants will be built")
+            return
+        # Not "fork": the log writer thread is already running, and a child
+        # forked with it could inherit a held lock. The fork server is a fresh
+        # single-threaded process that only preloads this module, so workers
+        # forked from it start quickly and without the parent's threads.
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+        else:
+            context = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(self._workers, mp_context=context)
+        self._pool.submit(os.getpid).result()
+        logger.info(f"Derivative pool started with {self._workers} processes "
+                    f"(webp={self._options.webp}, avif={self._options.avif}, ffmpeg={bool(self._options.ffmpeg)})")
+
+    def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def supports(self, kind: str) -> bool:
+        if self._pool is None:
+            return False
+        if kind == "video":
+            return self._options.ffmpeg is not None
+        return self._options.pillow
+
+    async def build(self, kind: str, asset: str) -> Dict[str, str]:
+        """Build the variants of ``asset`` and return them as variant name -> asset name."""
+        builder = build_video_variants if kind == "video" else build_image_variants
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self._building += 1
+        try:
+            built = await loop.run_in_executor(
+                self._pool, builder, self._assets.path(asset), self._assets.tmp_dir, self._options
+            )
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._building -= 1
+        self._built += 1
+        self._build_seconds += time.monotonic() - started
+        return {
+            variant: await self._assets.add(tmp_path, name, size)
+            for variant, (tmp_path, name, size) in built.items()
+        }
+
+    def stats(self) -> dict:
+        options = self._options
+        return {
+            "workers": self._workers if self._pool is not None else 0,
+            "formats": {
+                "webp": bool(options and options.webp),
+                "avif": bool(options and options.avif),
+                "videoPoster": bool(options and options.ffmpeg),
+            },
+            "building": self._building,
+            "built": self._built,
+            "failed": self._failed,
+            "avgBuildMs": round(self._build_seconds / self._built * 1000, 2) if self._built else None,
+        }
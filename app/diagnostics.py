@@ -0,0 +1,233 @@
+"""
+Event loop stall detection and on-demand request profiling.
+
+``LoopMonitor`` wakes every LOOP_LAG_INTERVAL and measures how late it
+was: that lateness is time the event loop spent running something else
+without yielding. A watchdog thread notices a stall while it is still in
+progress and captures the loop thread's stack, so the record names the
+blocking code rather than whatever ran after it.
+
+``ProfilingMiddleware`` samples the event loop thread for the duration of
+one request when it carries an ``X-Profile`` header equal to
+PROFILE_TOKEN (profiling is off while the token is empty). The response
+gets an ``X-Profile-Id`` header; the profile, in folded-stack format for
+flame graph tools, is then served by ``/api/debug/profiles/{id}``. Other
+requests running concurrently on the loop appear in the profile too.
+"""
+
+import os
+import sys
+import hmac
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, OrderedDict, deque
+from typing import Deque, Dict, Optional
+
+from app.metrics import EVENT_LOOP_LAG, EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+# Lag at which a stall is recorded with the blocking stack
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+LOOP_STALL_HISTORY = int(os.getenv("LOOP_STALL_HISTORY", 20))
+# Empty disables request profiling and the debug endpoints
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+PROFILE_HISTORY = int(os.getenv("PROFILE_HISTORY", 20))
+
+# Innermost frames kept in a stall's stack
+_STALL_STACK_LIMIT = 40
+
+
+def profiling_authorized(token: Optional[str]) -> bool:
+    """Whether ``token`` unlocks profiling; always False while PROFILE_TOKEN is unset."""
+    if not PROFILE_TOKEN or token is None:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILE_TOKEN.encode())
+
+
+class LoopMonitor:
+    """
+    Records event loop lag and captures the stack behind each stall.
+
+    Args:
+        interval: Seconds between lag measurements
+        threshold: Lag at which a stall is recorded
+        history: Stalls kept for ``/api/debug/stalls``
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD,
+                 history: int = LOOP_STALL_HISTORY):
+        self._interval = interval
+        self._threshold = threshold
+        self._loop_thread: Optional[int] = None
+        self._heartbeat = 0.0
+        # Stack taken by the watchdog during the stall in progress
+        self._stall_stack: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self.stalls: Deque[dict] = deque(maxlen=history)
+        self._stall_count = 0
+        self._max_lag = 0.0
+
+    def start(self):
+        """Start monitoring the running event loop."""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run(), name="loop-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self._interval
+            await asyncio.sleep(self._interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            EVENT_LOOP_LAG.observe(lag)
+            self._max_lag = max(self._max_lag, lag)
+            if lag >= self._threshold:
+                self._record_stall(lag)
+            else:
+                self._stall_stack = None
+
+    def _watch(self):
+        while not self._stopping.wait(self._threshold / 2):
+            overdue = time.monotonic() - self._heartbeat - self._interval
+            if overdue >= self._threshold and self._stall_stack is None:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stall_stack = "".join(traceback.format_stack(frame, limit=_STALL_STACK_LIMIT))
+
+    def _record_stall(self, lag: float):
+        stack, self._stall_stack = self._stall_stack, None
+        self._stall_count += 1
+        EVENT_LOOP_STALLS.inc()
+        self.stalls.append({"at": time.time(), "durationMs": round(lag * 1000, 1), "stack": stack})
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f}ms", extra={"stack": stack})
+
+    def stats(self) -> dict:
+        return {
+            "intervalMs": self._interval * 1000,
+            "stallThresholdMs": self._threshold * 1000,
+            "maxLagMs": round(self._max_lag * 1000, 1),
+            "stalls": self._stall_count,
+        }
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's stack from a background thread.
+
+    Args:
+        thread_id: Thread to sample (``threading.get_ident()`` of it)
+        interval: Seconds between samples
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.samples: Counter = Counter()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopping.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples[";".join(reversed(names))] += 1
+
+    def folded(self) -> str:
+        """One ``frame;frame;... count`` line per distinct stack, most frequent first."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+
+class ProfileStore:
+    """The most recent request profiles, by ID."""
+
+    def __init__(self, history: int = PROFILE_HISTORY):
+        self._history = history
+        self._profiles: "OrderedDict[str, dict]" = OrderedDict()
+
+    def add(self, profile: dict):
+        self._profiles[profile["id"]] = profile
+        while len(self._profiles) > self._history:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        return self._profiles.get(profile_id)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that carry a valid ``X-Profile`` header.
+
+    Args:
+        app: The wrapped ASGI app
+        store: Where finished profiles are kept
+    """
+
+    def __init__(self, app, store: ProfileStore):
+        self.app = app
+        self._store = store
+
+    async def __call__(self, scope, receive, send):
+        if not PROFILE_TOKEN or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        token = headers.get(b"x-profile")
+        if not profiling_authorized(token.decode("latin-1") if token is not None else None):
+            return await self.app(scope, receive, send)
+
+        profile = {"id": uuid.uuid4().hex[:16], "method": scope["method"], "path": scope["path"],
+                   "startedAt": time.time(), "status": "running"}
+        self._store.add(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile["id"].encode())]
+            await send(message)
+
+        profiler = SamplingProfiler(threading.get_ident())
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+            profile.update(
+                status="done",
+                durationMs=round((time.perf_counter() - started) * 1000, 1),
+                samples=sum(profiler.samples.values()),
+                folded=profiler.folded(),
+            )
@@ -0,0 +1,125 @@
+"""
+In-process fan-out of job status events.
+
+Publishers call ``EventBroadcaster.publish`` with a topic (``image:<id>``
+or ``video:<id>``) whenever a job changes state; every subscription
+interested in that topic gets the event on its own bounded queue.
+Publishing never blocks: a subscriber whose queue is full is evicted as a
+slow consumer instead of holding up everyone else.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 256))
+
+
+def job_topic(kind: str, job_id: str) -> str:
+    return f"{kind}:{job_id}"
+
+
+class Subscription:
+    """A subscriber's topic set and pending events."""
+
+    def __init__(self, maxsize: int, wildcard: bool = False):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.topics: Set[str] = set()
+        self.wildcard = wildcard
+        self.evicted = False
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        """Next event, or None once the subscription has been evicted."""
+        if self.evicted and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def put(self, event: Dict[str, Any]) -> bool:
+        """Queue an event without blocking; returns False if the queue is full."""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+
+class EventBroadcaster:
+    """
+    Topic-based publish/subscribe for a single process.
+
+    Args:
+        queue_size: Events buffered per subscriber before it is evicted
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self._queue_size = queue_size
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._wildcards: Set[Subscription] = set()
+        self._published = 0
+        self._evicted = 0
+
+    def subscribe(self, topics: Iterable[str] = (), wildcard: bool = False) -> Subscription:
+        """Create a subscription; ``wildcard`` subscriptions receive every event."""
+        subscription = Subscription(self._queue_size, wildcard=wildcard)
+        if wildcard:
+            self._wildcards.add(subscription)
+        self.add_topics(subscription, topics)
+        return subscription
+
+    def add_topics(self, subscription: Subscription, topics: Iterable[str]):
+        for topic in topics:
+            subscription.topics.add(topic)
+            self._topics.setdefault(topic, set()).add(subscription)
+
+    def remove_topics(self, subscription: Subscription, topics: Iterable[str]):
+        for topic in topics:
+            subscription.topics.discard(topic)
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    def unsubscribe(self, subscription: Subscription):
+        self.remove_topics(subscription, list(subscription.topics))
+        self._wildcards.discard(subscription)
+
+    def publish(self, topic: str, event: Dict[str, Any]) -> int:
+        """Deliver ``event`` to every subscriber of ``topic``; returns the number reached."""
+        self._published += 1
+        delivered = 0
+        for subscription in list(self._topics.get(topic, ())) + list(self._wildcards):
+            if subscription.put(event):
+                delivered += 1
+            else:
+                self.evict(subscription)
+        return delivered
+
+    def close(self, subscription: Subscription):
+        """Unsubscribe and end the subscription: its pending events are dropped and ``get`` returns None."""
+        self.unsubscribe(subscription)
+        subscription.evicted = True
+        # Drop what it has not read and wake it up so it can close
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def evict(self, subscription: Subscription):
+        """Close a subscriber that has fallen too far behind to take more events."""
+        self.close(subscription)
+        self._evicted += 1
+        logger.warning("Evicted slow event subscriber")
+
+    def stats(self) -> dict:
+        subscribers = set(self._wildcards)
+        for topic_subscribers in self._topics.values():
+            subscribers.update(topic_subscribers)
+        return {
+            "subscribers": len(subscribers),
+            "topics": len(self._topics),
+            "published": self._published,
+            "evicted": self._evicted,
+        }
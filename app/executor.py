@@ -0,0 +1,191 @@
+"""
+Execution layer for upstream model calls.
+
+Backend calls (``replicate.run``) are synchronous, so every call is pushed
+onto a dedicated thread pool to keep the event loop free. Each model gets its own
+concurrency limit, and time spent waiting for a slot is recorded so queue
+pressure is visible. Flow control (adaptive limits, retries, circuit
+breaking) comes from app.resilience. Cancelling the awaiting task frees the
+slot at once and tells the backend to stop the prediction.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.backends import GenerationBackend, PERMANENT, THROTTLED, TRANSIENT
+from app.metrics import UPSTREAM_REQUEST_DURATION
+from app.resilience import (
+    AdaptiveLimiter, CircuitBreaker, CircuitOpenError, UPSTREAM_RETRIES, backoff_delay
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MODEL_CONCURRENCY = int(os.getenv("IMAGE_MODEL_CONCURRENCY", 4))
+VIDEO_MODEL_CONCURRENCY = int(os.getenv("VIDEO_MODEL_CONCURRENCY", 2))
+UPSTREAM_THREADS = int(os.getenv("UPSTREAM_THREADS", 0)) or None
+
+
+class _ModelLane:
+    """Adaptive concurrency limit, circuit breaker and counters for one model."""
+
+    def __init__(self, model: str, limit: int):
+        self.limiter = AdaptiveLimiter(limit)
+        self.breaker = CircuitBreaker(model)
+        self.waiting = 0
+        self.calls = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limiter.limit),
+            "inFlight": self.limiter.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "avgQueueWaitMs": round(self.wait_total / self.calls * 1000, 2) if self.calls else 0.0,
+            "maxQueueWaitMs": round(self.wait_max * 1000, 2),
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "failures": self.failures,
+        }
+
+
+class UpstreamExecutor:
+    """
+    Runs upstream model predictions on a dedicated thread pool.
+
+    Throttled and transient failures are retried with jittered exponential
+    backoff, releasing the slot while waiting. Each model's concurrency
+    limit shrinks when the upstream throttles us or slows down and grows
+    back as calls succeed, and its circuit breaker rejects calls outright
+    while the upstream keeps failing.
+
+    Args:
+        backend: Backend whose ``run`` performs the prediction
+        limits: Maximum concurrent predictions per model identifier
+        max_threads: Size of the thread pool; defaults to the sum of limits
+        retries: Retries after a throttled or transient failure
+    """
+
+    def __init__(self, backend: GenerationBackend, limits: Dict[str, int],
+                 max_threads: Optional[int] = UPSTREAM_THREADS, retries: int = UPSTREAM_RETRIES):
+        self._backend = backend
+        self._lanes = {model: _ModelLane(model, limit) for model, limit in limits.items()}
+        self._max_threads = max_threads or sum(limits.values())
+        self._retries = retries
+        self._pool = ThreadPoolExecutor(max_workers=self._max_threads, thread_name_prefix="upstream")
+
+    async def run(self, model: str, input: Dict[str, Any],
+                  on_start: Optional[Callable[[float], Any]] = None) -> Any:
+        """
+        Run one prediction once a slot for ``model`` is free.
+
+        Args:
+            model: Model identifier
+            input: Model input parameters
+            on_start: Called (and awaited, if a coroutine function) with the
+                queue wait in seconds once the first slot is acquired
+
+        Returns:
+            The raw model output
+
+        Raises:
+            CircuitOpenError: If the model's circuit is open
+        """
+        lane = self._lanes[model]
+        # Fail fast rather than queue behind a circuit that is open
+        lane.breaker.check()
+        queued_at = time.monotonic()
+        attempt = 0
+        while True:
+            lane.waiting += 1
+            try:
+                await lane.limiter.acquire()
+            finally:
+                lane.waiting -= 1
+            try:
+                lane.breaker.before_call()
+            except CircuitOpenError:
+                lane.limiter.release()
+                raise
+            outcome = None
+            try:
+                if attempt == 0:
+                    waited = time.monotonic() - queued_at
+                    lane.calls += 1
+                    lane.wait_total += waited
+                    lane.wait_max = max(lane.wait_max, waited)
+                    if on_start:
+                        started = on_start(waited)
+                        if asyncio.iscoroutine(started):
+                            await started
+                loop = asyncio.get_running_loop()
+                called_at = time.monotonic()
+                cancelled = threading.Event()
+                try:
+                    output = await loop.run_in_executor(
+                        self._pool, functools.partial(self._backend.run, model, input, cancelled)
+                    )
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+                except Exception as e:
+                    outcome = self._backend.classify_error(e)
+                    if outcome == PERMANENT or attempt >= self._retries:
+                        raise
+                    error = e
+                else:
+                    outcome = "success"
+                    lane.limiter.on_success(time.monotonic() - called_at)
+                    lane.breaker.on_success()
+                    return output
+            finally:
+                if outcome is not None:
+                    UPSTREAM_REQUEST_DURATION.labels(model, outcome).observe(time.monotonic() - called_at)
+                if outcome == THROTTLED:
+                    lane.throttled += 1
+                    lane.limiter.on_throttle()
+                    lane.breaker.on_neutral()
+                elif outcome == TRANSIENT:
+                    lane.failures += 1
+                    lane.breaker.on_failure()
+                elif outcome != "success":
+                    lane.breaker.on_neutral()
+                lane.limiter.release()
+            attempt += 1
+            lane.retries += 1
+            delay = backoff_delay(attempt)
+            logger.warning(f"Upstream {model} call {outcome} ({error}); retry {attempt}/{self._retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def state(self) -> dict:
+        """Adaptive limits and circuit breaker state of every model."""
+        return {
+            model: {
+                "concurrency": {**lane.limiter.stats(), "inFlight": lane.limiter.in_flight, "waiting": lane.waiting},
+                "circuit": lane.breaker.stats(),
+                "retries": lane.retries,
+                "throttled": lane.throttled,
+                "failures": lane.failures,
+            }
+            for model, lane in self._lanes.items()
+        }
+
+    def stats(self) -> dict:
+        return {
+            "backend": self._backend.name,
+            "threads": self._max_threads,
+            "models": {model: lane.stats() for model, lane in self._lanes.items()},
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,254 @@
+"""
+Background job queue and worker pool for generation requests.
+
+Endpoints submit jobs here instead of calling the upstream model inline, so
+the number of concurrent generations is bounded by the worker pool rather
+than by the number of open HTTP connections. The order in which queued jobs
+start is decided by app.scheduler (lanes, priorities, per-client fairness).
+Queued and running jobs can be cancelled.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.scheduler import FairScheduler, DEFAULT_PRIORITY, PRIORITIES
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", 1000))
+JOB_COALESCE = os.getenv("JOB_COALESCE", "true").lower() == "true"
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobCancelledError(Exception):
+    """Set on the future of a job that was cancelled before it finished."""
+
+
+@dataclass(slots=True)
+class Job:
+    kind: str
+    job_id: str
+    prompt: str
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    key: Optional[str] = None
+    # IDs of identical jobs attached to this one while it was in flight
+    followers: List[str] = field(default_factory=list)
+    # For a follower, the ID of the job that actually runs upstream
+    shared_with: Optional[str] = None
+    priority: str = DEFAULT_PRIORITY
+    # Identity the job is accounted to for fair sharing
+    client: str = "anonymous"
+    # Cancelled by its own submitter but still running for its followers
+    abandoned: bool = False
+    # Traced span of the operation that submitted the job; parents its phase spans
+    trace_parent: Any = None
+
+    @property
+    def job_ids(self) -> List[str]:
+        """IDs whose records follow this job's progress."""
+        if self.abandoned:
+            return list(self.followers)
+        return [self.job_id, *self.followers]
+
+
+def completed_job(kind: str, job_id: str, prompt: str, result: Any) -> Job:
+    """Build a Job whose result is already known, without queueing it."""
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(result)
+    return Job(kind=kind, job_id=job_id, prompt=prompt, future=future)
+
+
+def _consume_result(future: asyncio.Future):
+    # Jobs submitted in async mode are never awaited; retrieve the exception
+    # so asyncio does not log "exception was never retrieved".
+    if not future.cancelled():
+        future.exception()
+
+
+class JobQueue:
+    """
+    Queue of jobs drained by a fixed pool of asyncio worker tasks.
+
+    Args:
+        handler: Async function called with each Job; its return value
+            becomes the result of ``job.future``
+        workers: Number of concurrent worker tasks
+        maxsize: Maximum number of queued (not yet running) jobs
+        coalesce: Attach jobs submitted with the same key to the one
+            already in flight instead of running them again
+        scheduler: Decides which queued job starts next; by default a
+            FairScheduler sized for ``workers``
+    """
+
+    def __init__(self, handler: Callable[[Job], Awaitable[Any]],
+                 workers: int = JOB_WORKERS, maxsize: int = JOB_QUEUE_SIZE,
+                 coalesce: bool = JOB_COALESCE, scheduler: Optional[FairScheduler] = None):
+        self._handler = handler
+        self._workers = workers
+        self._maxsize = maxsize
+        self._coalesce = coalesce
+        self._scheduler = scheduler or FairScheduler(workers)
+        self._started = False
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+        self._inflight: Dict[str, Job] = {}
+        self._coalesced = 0
+        # (kind, job_id) of every queued or running job, and of its followers
+        self._jobs: Dict[Tuple[str, str], Job] = {}
+        self._followers: Dict[Tuple[str, str], Job] = {}
+        # (kind, job_id) -> handler task of each running job
+        self._handling: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._cancelled = 0
+
+    async def start(self):
+        self._started = True
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"job-worker-{n}")
+            for n in range(self._workers)
+        ]
+        logger.info(f"Started {self._workers} job workers (queue size {self._maxsize})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Job workers stopped")
+
+    def submit(self, kind: str, job_id: str, prompt: str, key: Optional[str] = None,
+               priority: str = DEFAULT_PRIORITY, client: str = "anonymous", trace_parent: Any = None) -> Job:
+        """
+        Enqueue a job and return it; await ``job.future`` for the result.
+
+        If coalescing is enabled and a job with the same ``key`` is still in
+        flight, nothing is enqueued: ``job_id`` is attached to that job as a
+        follower and the returned Job shares its future.
+
+        Args:
+            priority: One of PRIORITIES
+            client: Identity used for fair sharing between clients
+            trace_parent: Span to parent the job's phase spans (see app.telemetry)
+        """
+        if not self._started:
+            raise RuntimeError("Job queue has not been started")
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of: {', '.join(PRIORITIES)})")
+        if self._coalesce and key is not None:
+            leader = self._inflight.get(key)
+            if leader is not None and not leader.future.done():
+                leader.followers.append(job_id)
+                self._followers[(kind, job_id)] = leader
+                self._coalesced += 1
+                return replace(leader, job_id=job_id, followers=[], shared_with=leader.job_id)
+        if len(self._scheduler) >= self._maxsize:
+            raise QueueFullError(f"Job queue is full ({self._maxsize} jobs waiting)")
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_result)
+        job = Job(kind=kind, job_id=job_id, prompt=prompt, future=future, key=key,
+                  priority=priority, client=client, trace_parent=trace_parent)
+        self._scheduler.put(job)
+        self._jobs[(kind, job_id)] = job
+        future.add_done_callback(lambda _: self._forget(job))
+        if self._coalesce and key is not None:
+            self._inflight[key] = job
+        return job
+
+    def _forget(self, job: Job):
+        self._jobs.pop((job.kind, job.job_id), None)
+        for follower in job.followers:
+            self._followers.pop((job.kind, follower), None)
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def cancel(self, kind: str, job_id: str) -> bool:
+        """
+        Withdraw a queued or running job.
+
+        A queued job is taken out of the scheduler; a running job's handler
+        is cancelled, which frees its worker and upstream slot. Either way
+        its future fails with JobCancelledError. A job that other requests
+        were coalesced onto keeps running for them, and a follower is only
+        detached from the job it shares.
+
+        Returns:
+            False if no queued or running job has this ID
+        """
+        leader = self._followers.pop((kind, job_id), None)
+        if leader is not None:
+            leader.followers.remove(job_id)
+            if leader.abandoned and not leader.followers:
+                self._cancel(leader)
+            return True
+        job = self._jobs.get((kind, job_id))
+        if job is None:
+            return False
+        if job.followers:
+            job.abandoned = True
+        else:
+            self._cancel(job)
+        return True
+
+    def _cancel(self, job: Job):
+        task = self._handling.get((job.kind, job.job_id))
+        if task is not None:
+            task.cancel()
+        else:
+            self._scheduler.remove(job)
+        if not job.future.done():
+            job.future.set_exception(JobCancelledError(f"{job.kind.capitalize()} job {job.job_id} was cancelled"))
+        self._cancelled += 1
+        logger.info(f"Cancelled {'running' if task is not None else 'queued'} {job.kind} job {job.job_id}")
+
+    def queued(self) -> Dict[Tuple[str, str], int]:
+        """Number of queued jobs per (kind, priority)."""
+        return self._scheduler.queued()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self._workers,
+            "running": self._running,
+            "queued": len(self._scheduler),
+            "maxQueued": self._maxsize,
+            "inFlightKeys": len(self._inflight),
+            "coalesced": self._coalesced,
+            "cancelled": self._cancelled,
+            "scheduler": self._scheduler.stats(),
+        }
+
+    async def _worker(self, n: int):
+        while True:
+            job = await self._scheduler.get()
+            self._running += 1
+            # Its own task, so cancel() can stop the job without stopping the worker
+            task = asyncio.create_task(self._handler(job))
+            self._handling[(job.kind, job.job_id)] = task
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            finally:
+                del self._handling[(job.kind, job.job_id)]
+                self._running -= 1
+                self._scheduler.done(job)
+            if task.cancelled():
+                error = JobCancelledError(f"{job.kind.capitalize()} job {job.job_id} was cancelled")
+            else:
+                error = task.exception()
+            if job.future.done():
+                continue
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(task.result())
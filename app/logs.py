@@ -0,0 +1,340 @@
+"""
+Logging pipeline.
+
+Records are handed to a queue on the calling thread (the event loop, most
+of the time) and formatted and written in batches by a background thread,
+so disk and console I/O never block request handling. Records are written as
+one JSON object per line; anything passed through ``extra=`` becomes a
+field. The log file rotates both by size and by age.
+
+The access log is one record per request from ``AccessLogMiddleware``,
+sampled at ACCESS_LOG_SAMPLE_RATE; server errors and slow requests are
+always logged.
+"""
+
+import os
+import sys
+import json
+import time
+import copy
+import glob
+import queue
+import atexit
+import random
+import logging
+import threading
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import BaseRotatingHandler, QueueHandler
+from typing import List, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# JSON lines; set to false for the human-readable format below
+LOG_JSON = os.getenv("LOG_JSON", "true").lower() == "true"
+LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+# Empty disables the log file
+LOG_FILE = os.getenv("LOG_FILE", "server.log")
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", 50 * 1024 * 1024))
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", 86400))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 7))
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Seconds the writer thread waits between batches
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 0.05))
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", 1.0))
+# Requests at least this slow are always logged
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", 1000))
+# Prompts are cut to this many characters in log messages
+LOG_PROMPT_CHARS = int(os.getenv("LOG_PROMPT_CHARS", 80))
+
+# Loggers the uvicorn CLI gives their own (synchronous, plain-text) handlers
+_UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Attributes every LogRecord has; anything else came from ``extra=``
+# (except uvicorn's ANSI-coloured copy of the message)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "color_message"}
+
+access_logger = logging.getLogger("access")
+
+
+def prompt_preview(prompt: str, limit: int = LOG_PROMPT_CHARS) -> str:
+    """A prompt shortened for log messages."""
+    if len(prompt) <= limit:
+        return prompt
+    return f"{prompt[:limit]}… ({len(prompt)} chars)"
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and extras."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RotatingFileHandler(BaseRotatingHandler):
+    """
+    File handler that rotates when the file reaches ``max_bytes`` or is
+    ``max_age`` seconds old, whichever comes first. Rotated files get a
+    timestamp suffix; only the newest ``backup_count`` are kept.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = LOG_ROTATE_BYTES,
+                 max_age: float = LOG_ROTATE_SECONDS, backup_count: int = LOG_BACKUP_COUNT):
+        super().__init__(filename, "a", encoding="utf-8", delay=False)
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._backup_count = backup_count
+        try:
+            opened = os.stat(self.baseFilename).st_mtime if self.stream.tell() else time.time()
+        except OSError:
+            opened = time.time()
+        self._rollover_at = opened + max_age if max_age > 0 else float("inf")
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self._rollover_at:
+            return True
+        if self._max_bytes > 0 and self.stream is not None:
+            # Unflushed records are not counted, so the file may overshoot by one batch
+            return os.fstat(self.stream.fileno()).st_size >= self._max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        suffix = datetime.now().strftime("%Y%m%d-%H%M%S")
+        target = f"{self.baseFilename}.{suffix}"
+        n = 1
+        while os.path.exists(target):
+            target = f"{self.baseFilename}.{suffix}.{n}"
+            n += 1
+        if os.path.exists(self.baseFilename):
+            os.rename(self.baseFilename, target)
+        if self._backup_count > 0:
+            backups = sorted(glob.glob(glob.escape(self.baseFilename) + ".*"), key=os.path.getmtime)
+            for old in backups[:-self._backup_count]:
+                os.unlink(old)
+        self.stream = self._open()
+        if self._max_age > 0:
+            self._rollover_at = time.time() + self._max_age
+
+
+class _LogQueueHandler(QueueHandler):
+    """Hands records to the writer thread without blocking; drops them if it falls behind."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve everything tied to the caller's state now; format later
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _BatchFlush:
+    """Handler mixin: ``emit`` no longer flushes; the writer flushes once per batch."""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class _StreamHandler(_BatchFlush, logging.StreamHandler):
+    pass
+
+
+class _RotatingFileHandler(_BatchFlush, RotatingFileHandler):
+    pass
+
+
+class LogWriter:
+    """
+    Background thread writing queued records to the handlers.
+
+    It drains everything queued, writes and flushes it as one batch, then
+    sleeps for ``interval``, so a busy server wakes it a bounded number of
+    times per second rather than once per record.
+
+    Args:
+        log_queue: Queue filled by the QueueHandler on the root logger
+        handlers: Handlers that format and write the records
+        interval: Seconds between batches
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_queue: queue.Queue, handlers: List[logging.Handler],
+                 interval: float = LOG_FLUSH_INTERVAL):
+        self.queue = log_queue
+        self.handlers = handlers
+        self._interval = interval
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+            for handler in self.handlers:
+                handler.close()
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            try:
+                while True:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            stopping = False
+            for record in records:
+                if record is self._STOP:
+                    stopping = True
+                    continue
+                for handler in self.handlers:
+                    if record.levelno >= handler.level:
+                        handler.handle(record)
+            for handler in self.handlers:
+                handler.flush_batch()
+            self.batches += 1
+            if stopping:
+                return
+            time.sleep(self._interval)
+
+
+_writer: Optional[LogWriter] = None
+_queue_handler: Optional[_LogQueueHandler] = None
+
+
+def configure_logging():
+    """
+    Route all logging through the queue to the console and the log file.
+
+    Replaces any handlers already on the root logger (some SDKs call
+    ``logging.basicConfig`` at import time) and on uvicorn's loggers, which
+    the uvicorn CLI configures with ``propagate=False`` before importing the
+    app. Safe to call more than once.
+    """
+    global _writer, _queue_handler
+    if _writer is not None:
+        return
+    formatter = JSONFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    handlers = [_StreamHandler(sys.stderr)]
+    if LOG_FILE:
+        handlers.append(_RotatingFileHandler(LOG_FILE))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _queue_handler = _LogQueueHandler(log_queue)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name in _UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        for handler in list(uvicorn_logger.handlers):
+            uvicorn_logger.removeHandler(handler)
+        uvicorn_logger.propagate = True
+    # AccessLogMiddleware writes the (sampled) access log; uvicorn's would duplicate it
+    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+    # One INFO line per HTTP call; asset downloads log their own summary
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    _writer = LogWriter(log_queue, handlers)
+    _writer.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def logging_stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler else 0,
+        "dropped": _queue_handler.dropped if _queue_handler else 0,
+        "batches": _writer.batches if _writer else 0,
+        "accessSampleRate": ACCESS_LOG_SAMPLE_RATE,
+    }
+
+
+class AccessLogMiddleware:
+    """
+    ASGI middleware writing one access record per HTTP request.
+
+    Args:
+        app: The wrapped ASGI app
+        sample_rate: Fraction of ordinary requests logged
+        slow_ms: Requests taking at least this long are always logged, as
+            are responses with a 5xx status
+    """
+
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE, slow_ms: float = ACCESS_LOG_SLOW_MS):
+        self.app = app
+        self._sample_rate = sample_rate
+        self._slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if status >= 500 or duration_ms >= self._slow_ms or random.random() < self._sample_rate:
+                client = scope.get("client")
+                access_logger.info(
+                    f"{scope['method']} {scope['path']} {status} {duration_ms:.1f}ms",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status,
+                        "durationMs": round(duration_ms, 2),
+                        "client": client[0] if client else None,
+                    }
+                )
@@ -1,97 +1,72 @@
 import os
+import hmac
+import hashlib
+import secrets
 from dotenv import load_dotenv
-load_dotenv()  # Must be before langtrace import/init
+load_dotenv()  # Must be before the app modules read their settings
 import logging
 import contextlib
-import replicate
 import traceback
-from langtrace_python_sdk import inject_additional_attributes
 
 # --- Logging configuration ---
-LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-LOG_FILE = "server.log"
-
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(LOG_FILE)
-    ]
-)
+from app.logs import configure_logging, logging_stats, prompt_preview, AccessLogMiddleware
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# --- Safe langtrace initialization ---
-langtrace = None
-langtrace_available = False
-try:
-    from langtrace_python_sdk import langtrace as _langtrace
-    api_key = os.getenv("LANGTRACE_API_KEY")
-    if api_key:
-        _langtrace.init(api_key=api_key)
-        langtrace = _langtrace
-        langtrace_available = True
-        logger.info("langtrace initialized successfully.")
-    else:
-        logger.warning("LANGTRACE_API_KEY not set. langtrace is disabled.")
-except Exception as e:
-    logger.error(f"Failed to initialize langtrace: {e}")
-    logger.error(traceback.format_exc())
-    langtrace = None
-    langtrace_available = False
+# langtrace is initialized in the background after startup (see warm_up)
+from app.telemetry import (start_telemetry, telemetry_status, traced, current_span, start_span, end_span,
+                           record_span, child_span)
 
 # --- Tracing helper function ---
 async def trace_operation(operation_name, operation_func, attributes=None):
     """
-    Helper function to trace operations using OpenTelemetry.
-    
+    Run an operation inside a (sampled) root span.
+
+    Jobs submitted by the operation carry the span, so their queue wait,
+    upstream prediction and asset download show up as its children. The
+    operation runs exactly once whatever happens to tracing.
+
     Args:
         operation_name: Name of the operation being traced
         operation_func: Async function to execute
-        attributes: Additional attributes to add to the trace
-    
+        attributes: Additional attributes to add to the span
+
     Returns:
         Result of the operation function
     """
-    if not langtrace_available:
-        logger.info(f"Tracing skipped (langtrace unavailable): {operation_name}")
-        return await operation_func()
-    
-    logger.info(f"Tracing operation: {operation_name}")
-    try:
-        from opentelemetry import trace
-        tracer = trace.get_tracer(__name__)
-        
-        # Create span attributes
-        span_attributes = {"operation.name": operation_name}
-        if attributes:
-            span_attributes.update(attributes)
-        
-        # Create and use span
-        with tracer.start_as_current_span(operation_name, attributes=span_attributes) as span:
-            logger.info(f"Started span: {operation_name}")
-            result = await operation_func()
-            span.set_attribute("operation.status", "success")
-            logger.info(f"Completed span: {operation_name}")
-            return result
-            
-    except Exception as e:
-        logger.error(f"Tracing error for '{operation_name}': {e}")
-        logger.error(traceback.format_exc())
-        # Fallback to executing without tracing
+    with traced(operation_name, attributes):
         return await operation_func()
 
 import time
 import json
 import uuid
-from typing import Dict, Any, Optional, List
+import asyncio
+from typing import Dict, Any, Optional, List, Set, Tuple, AsyncIterator
 from datetime import datetime
 
-from fastapi import FastAPI, HTTPException, Request, Response
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Response, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+
+from app.jobs import Job, JobQueue, QueueFullError, JobCancelledError, completed_job
+from app.scheduler import PRIORITIES, DEFAULT_PRIORITY
+from app.backends import create_backend
+from app.executor import UpstreamExecutor, IMAGE_MODEL_CONCURRENCY, VIDEO_MODEL_CONCURRENCY
+from app.resilience import CircuitOpenError
+from app.cache import ResultCache, RESULT_CACHE_ENABLED, cache_key
+from app.batching import MicroBatcher, IMAGE_BATCH_WINDOW_MS
+from app.store import JobStore, JobRecord, InvalidCursorError, FINISHED_STATUSES
+from app.events import EventBroadcaster, job_topic
+from app.assets import AssetStore, ASSET_MIRROR_ENABLED, ASSET_NAME
+from app.derivatives import DerivativeBuilder, DERIVATIVES_ENABLED
+from app.diagnostics import (LoopMonitor, ProfileStore, ProfilingMiddleware, profiling_authorized,
+                             LOOP_MONITOR_ENABLED)
+from app.metrics import (REGISTRY, CONTENT_TYPE, Gauge, MetricsMiddleware, JOB_QUEUE_WAIT, GENERATION_ERRORS,
+                         RESULT_CACHE_LOOKUPS)
+from app.mcp import ToolRegistry, ToolContext, ToolError, SessionHub, SessionLimitError
 
 app = FastAPI(title="Text-to-Image API", version="1.0.0")
 
@@ -104,20 +79,346 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One sampled access record per request, written off the event loop
+app.add_middleware(AccessLogMiddleware)
+
+# Latency histogram and in-flight gauge for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Requests with a valid X-Profile header are profiled (PROFILE_TOKEN)
+profile_store = ProfileStore()
+app.add_middleware(ProfilingMiddleware, store=profile_store)
+
+# Event loop lag and stall stacks
+loop_monitor = LoopMonitor() if LOOP_MONITOR_ENABLED else None
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# In-memory storage for generated images and videos
-generated_images = {}
-generated_videos = {}
+# Persistent storage for generated image and video job records
+job_store = JobStore()
+
+# Job status transitions, pushed to WebSocket subscribers
+job_events = EventBroadcaster()
+
+# Long-running tasks started with the app and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
+# Set by warm_up once the heavy SDKs are loaded; reported by /ready
+warmed_up = False
+
+backend = create_backend()
+
+# Local, content-addressed copies of finished outputs (upstream URLs expire);
+# off for backends whose outputs cannot be fetched, e.g. fake placeholders
+asset_store = AssetStore() if ASSET_MIRROR_ENABLED and backend.downloadable_outputs else None
+# Prefix for mirrored asset URLs; empty gives paths relative to this server
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+# Thumbnails and compressed variants of mirrored outputs, built in a process pool
+derivative_builder = DerivativeBuilder(asset_store) if asset_store is not None and DERIVATIVES_ENABLED else None
+derivative_tasks: Set[asyncio.Task] = set()
+
+class GenerationError(Exception):
+    """Raised when the upstream model returns no output."""
+
+def new_job_id() -> str:
+    return str(uuid.uuid4()).replace("-", "")[:12]
+
+def isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp is not None else None
+
+def public_url(url: Optional[str], asset: Optional[str]) -> Optional[str]:
+    """URL clients should use for an output: our mirror when we hold a copy."""
+    if asset and asset_store is not None and asset_store.has(asset):
+        return f"{PUBLIC_BASE_URL}/api/assets/{asset}"
+    return url
+
+def variant_urls(variants: Optional[Dict[str, str]]) -> Optional[Dict[str, str]]:
+    """Public URLs of the derived variants still held in the asset store."""
+    if not variants or asset_store is None:
+        return None
+    return {name: public_url(None, asset) for name, asset in variants.items() if asset_store.has(asset)} or None
+
+async def mirror_output(url: str, trace_parent: Any = None) -> Optional[str]:
+    """Copy an output into the asset store; failures leave only the upstream URL."""
+    if asset_store is None:
+        return None
+    try:
+        with child_span("asset-download", trace_parent):
+            return await asset_store.mirror(url)
+    except Exception as e:
+        logger.warning(f"Could not mirror {url}: {e}")
+        return None
+
+def publish_job_event(kind: str, job_ids: List[str], fields: Dict[str, Any]):
+    """Push a status transition of one or more jobs to their subscribers."""
+    event = {"type": "status", "kind": kind, "status": fields["status"]}
+    if "started_at" in fields:
+        event["startedAt"] = isoformat(fields["started_at"])
+    if "queue_wait_ms" in fields:
+        event["queueWaitMs"] = fields["queue_wait_ms"]
+    if "completed_at" in fields:
+        event["completedAt"] = isoformat(fields["completed_at"])
+    if "url" in fields:
+        event[f"{kind}Url"] = public_url(fields["url"], fields.get("asset"))
+    if "error" in fields:
+        event["error"] = fields["error"]
+    if "cached" in fields:
+        event["cached"] = fields["cached"]
+    for job_id in job_ids:
+        job_events.publish(job_topic(kind, job_id), {**event, "id": job_id})
+
+async def update_job_records(kind: str, job: Job, fields: Dict[str, Any]):
+    """Apply ``fields`` to the record of a job and of every follower attached to it."""
+    updated: Set[str] = set()
+    # Followers can attach (or the leader be abandoned) while the write is in
+    # flight; loop until every current ID has been written exactly once
+    while True:
+        pending = [job_id for job_id in job.job_ids if job_id not in updated]
+        if not pending:
+            return
+        await job_store.update(kind, pending, fields)
+        if "status" in fields:
+            publish_job_event(kind, pending, fields)
+        updated.update(pending)
+
+async def run_generation_job(job: Job):
+    """Worker handler: run one queued generation and record its progress."""
+    model = backend.models[job.kind]
+    if not await job_store.exists_any(job.kind, job.job_ids):
+        # Deleted while it was waiting in the queue
+        logger.info(f"Skipping {job.kind} job {job.job_id}: record no longer exists")
+        return None
+    prediction_span = None
+    async def mark_started(slot_wait: float):
+        nonlocal prediction_span
+        queue_wait = time.monotonic() - job.enqueued_at
+        JOB_QUEUE_WAIT.labels(job.kind, job.priority).observe(queue_wait)
+        record_span("queue-wait", job.trace_parent, queue_wait, {"job.priority": job.priority})
+        prediction_span = start_span("upstream-prediction", job.trace_parent, {"model": model})
+        await update_job_records(job.kind, job, {
+            "status": "processing",
+            "started_at": time.time(),
+            "queue_wait_ms": round(queue_wait * 1000, 2)
+        })
+    model_input = {"prompt": job.prompt}
+    try:
+        if job.kind == "image" and image_batcher is not None:
+            image = await image_batcher.submit(model_input, on_start=mark_started)
+            output = [image] if image else None
+        else:
+            output = await upstream.run(model, model_input, on_start=mark_started)
+        if not output or len(output) == 0:
+            raise GenerationError(f"No {job.kind} generated")
+    except Exception as e:
+        end_span(prediction_span, e)
+        GENERATION_ERRORS.labels(job.kind).inc()
+        await update_job_records(job.kind, job, {
+            "status": "error",
+            "error": str(e),
+            "completed_at": time.time()
+        })
+        raise
+    except asyncio.CancelledError as e:
+        end_span(prediction_span, e)
+        raise
+    end_span(prediction_span)
+    url = output[0] if isinstance(output, list) else output
+    asset = await mirror_output(url, job.trace_parent)
+    key = cache_key(model, model_input)
+    if uses_result_cache(job.kind):
+        await result_cache.put(key, {"url": url, "asset": asset})
+    await update_job_records(job.kind, job, {
+        "status": "ready",
+        "url": url,
+        "asset": asset,
+        "completed_at": time.time()
+    })
+    if asset is not None and derivative_builder is not None and derivative_builder.supports(job.kind):
+        # Off the job's critical path: the result is usable before its variants exist
+        task = asyncio.create_task(build_derivatives(job, key, url, asset))
+        derivative_tasks.add(task)
+        task.add_done_callback(derivative_tasks.discard)
+    return public_url(url, asset)
+
+async def build_derivatives(job: Job, key: str, url: str, asset: str):
+    """Build thumbnails and compressed variants of a finished output and record them."""
+    try:
+        variants = await derivative_builder.build(job.kind, asset)
+    except Exception as e:
+        logger.warning(f"Could not build variants of {job.kind} job {job.job_id}: {e}")
+        return
+    await update_job_records(job.kind, job, {"variants": variants})
+    if uses_result_cache(job.kind):
+        await result_cache.put(key, {"url": url, "asset": asset, "variants": variants})
+
+upstream = UpstreamExecutor(backend, {
+    backend.models["image"]: IMAGE_MODEL_CONCURRENCY,
+    backend.models["video"]: VIDEO_MODEL_CONCURRENCY,
+})
+job_queue = JobQueue(run_generation_job)
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+
+async def run_image_batch(model_input: Dict[str, Any], size: int, on_start):
+    if size > 1:
+        model_input = {**model_input, "num_outputs": size}
+    return await upstream.run(backend.models["image"], model_input, on_start=on_start)
+
+# Optional: merge identical image requests arriving within the window into one
+# multi-output SDXL prediction. Each caller then gets a distinct image, so
+# image jobs are not coalesced while batching is on.
+image_batcher = MicroBatcher(run_image_batch) if IMAGE_BATCH_WINDOW_MS > 0 else None
+
+def uses_result_cache(kind: str) -> bool:
+    """Whether results of ``kind`` are cached; not images while batching, which promises a distinct image per request."""
+    return result_cache is not None and not (kind == "image" and image_batcher is not None)
+
+# Empty: no caller may use the interactive priority or name its own client
+INTERACTIVE_TOKEN = os.getenv("INTERACTIVE_TOKEN", "")
+# Signed visitor pass set by "/" so the bundled web interface may submit interactive jobs
+INTERACTIVE_COOKIE = "interactive_pass"
+INTERACTIVE_PASS_TTL = float(os.getenv("INTERACTIVE_PASS_TTL", 86400))
+
+def client_address(http_request: Request) -> str:
+    return http_request.client.host if http_request.client else "anonymous"
+
+def _pass_signature(nonce: str, issued: str, address: str) -> str:
+    message = f"{nonce}.{issued}.{address}".encode()
+    return hmac.new(INTERACTIVE_TOKEN.encode(), message, hashlib.sha256).hexdigest()
+
+def issue_visitor_pass(address: str) -> str:
+    """An opaque pass for one visitor, bound to their address; the token itself never leaves the server."""
+    nonce, issued = secrets.token_urlsafe(12), str(int(time.time()))
+    return f"{nonce}.{issued}.{_pass_signature(nonce, issued, address)}"
+
+def valid_visitor_pass(value: Optional[str], address: str) -> bool:
+    if not INTERACTIVE_TOKEN or not value or value.count(".") != 2:
+        return False
+    nonce, issued, signature = value.split(".")
+    if not issued.isdigit() or time.time() - int(issued) > INTERACTIVE_PASS_TTL:
+        return False
+    return hmac.compare_digest(signature, _pass_signature(nonce, issued, address))
+
+def trusted_caller(http_request: Request) -> bool:
+    """Whether the request carries INTERACTIVE_TOKEN in its ``X-Interactive-Token`` header."""
+    if not INTERACTIVE_TOKEN:
+        return False
+    token = http_request.headers.get("x-interactive-token")
+    return token is not None and hmac.compare_digest(token.encode(), INTERACTIVE_TOKEN.encode())
+
+def job_origin(http_request: Request, default_priority: str = DEFAULT_PRIORITY) -> Tuple[str, str]:
+    """Scheduling priority and client identity of a request.
+
+    The priority comes from the ``X-Priority`` header, but ``interactive``
+    is only honoured for trusted callers and for web interface visitors
+    holding a valid pass; everyone else is downgraded to ``normal``. The
+    client is the caller's address, so it cannot be changed per request to
+    get a fresh fair-share bucket; only trusted callers may name it with
+    ``X-Client-Id``.
+    """
+    priority = http_request.headers.get("x-priority", default_priority).strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"X-Priority must be one of: {', '.join(PRIORITIES)}")
+    address = client_address(http_request)
+    trusted = trusted_caller(http_request)
+    if priority == "interactive" and not (
+            trusted or valid_visitor_pass(http_request.cookies.get(INTERACTIVE_COOKIE), address)):
+        priority = DEFAULT_PRIORITY
+    client = http_request.headers.get("x-client-id") if trusted else None
+    return priority, client or address
+
+async def submit_generation(kind: str, prompt: str, priority: str = DEFAULT_PRIORITY,
+                            client: str = "anonymous") -> Job:
+    """Create a job record and either answer it from the result cache or
+    hand it to the worker pool."""
+    model = backend.models[kind]
+    job_id = new_job_id()
+    key = cache_key(model, {"prompt": prompt})
+    if uses_result_cache(kind):
+        cached = await result_cache.get(key)
+        RESULT_CACHE_LOOKUPS.labels(kind, "miss" if cached is None else "hit").inc()
+        if cached is not None:
+            now = time.time()
+            asset = cached.get("asset")
+            if asset is not None and (asset_store is None or not asset_store.has(asset)):
+                asset = None
+            variants = cached.get("variants") if asset is not None else None
+            await job_store.create(JobRecord(
+                id=job_id,
+                kind=kind,
+                prompt=prompt,
+                status="ready",
+                created_at=now,
+                completed_at=now,
+                url=cached["url"],
+                cached=True,
+                asset=asset,
+                variants=variants
+            ))
+            publish_job_event(kind, [job_id], {
+                "status": "ready",
+                "completed_at": now,
+                "url": cached["url"],
+                "asset": asset,
+                "cached": True
+            })
+            logger.info(f"Result cache hit for {kind} job {job_id}")
+            return completed_job(kind, job_id, prompt, public_url(cached["url"], asset))
+    await job_store.create(JobRecord(
+        id=job_id,
+        kind=kind,
+        prompt=prompt,
+        status="queued",
+        created_at=time.time()
+    ))
+    publish_job_event(kind, [job_id], {"status": "queued"})
+    coalesce_key = None if kind == "image" and image_batcher is not None else key
+    try:
+        job = job_queue.submit(kind, job_id, prompt, key=coalesce_key, priority=priority, client=client,
+                               trace_parent=current_span())
+    except QueueFullError:
+        await job_store.delete(kind, job_id)
+        raise
+    if job.shared_with is not None:
+        # Coalesced onto an identical in-flight job: mirror its progress.
+        # Store calls run in order, so later updates from the leader land after this.
+        await job_store.link_follower(kind, job_id, job.shared_with)
+        logger.info(f"{kind.capitalize()} job {job_id} coalesced onto in-flight job {job.shared_with}")
+    return job
+
+def job_status(record: JobRecord) -> Dict[str, Any]:
+    """Public representation of a job record for the status endpoints."""
+    return {
+        "id": record.id,
+        "status": record.status,
+        "prompt": record.prompt,
+        "createdAt": isoformat(record.created_at),
+        "startedAt": isoformat(record.started_at),
+        "queueWaitMs": record.queue_wait_ms,
+        "completedAt": isoformat(record.completed_at),
+        f"{record.kind}Url": public_url(record.url, record.asset),
+        "sourceUrl": record.url,
+        "variants": variant_urls(record.variants),
+        "error": record.error,
+        "cached": record.cached,
+        "sharedWith": record.shared_with
+    }
 
 # Pydantic models
 class ImageRequest(BaseModel):
     prompt: str
 
+# Most prompts accepted by one bulk request, and how many of them it may
+# have queued or running at once
+BULK_MAX_PROMPTS = int(os.getenv("BULK_MAX_PROMPTS", 500))
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", 16))
+
+class BulkImageRequest(BaseModel):
+    prompts: List[str] = Field(..., min_length=1, max_length=BULK_MAX_PROMPTS)
+
 class ImageResponse(BaseModel):
     imageId: str
-    imageUrl: str
+    imageUrl: Optional[str] = None
     status: str
     message: str
 
@@ -126,455 +427,686 @@ class VideoRequest(BaseModel):
 
 class VideoResponse(BaseModel):
     videoId: str
-    videoUrl: str
+    videoUrl: Optional[str] = None
     status: str
     message: str
 
-class MCPRequest(BaseModel):
-    method: str
-    params: Optional[Dict[str, Any]] = None
-
-class MCPTool(BaseModel):
-    name: str
-    description: str
-    inputSchema: Dict[str, Any]
-
-class MCPResponse(BaseModel):
-    tools: Optional[List[MCPTool]] = None
-    content: Optional[List[Dict[str, Any]]] = None
-
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting FastAPI server...")
+    mcp_tools.prepare()
+    if derivative_builder is not None:
+        derivative_builder.start()
+    if loop_monitor is not None:
+        loop_monitor.start()
+    await job_store.open()
+    if asset_store is not None:
+        await asset_store.open()
+    interrupted = await job_store.fail_unfinished("Interrupted by server restart", time.time())
+    if interrupted:
+        logger.warning(f"Marked {interrupted} unfinished jobs from a previous run as failed")
+    await job_queue.start()
+    background_tasks.append(asyncio.create_task(job_store.run_retention(), name="job-retention"))
+    background_tasks.append(asyncio.create_task(
+        job_store.run_heartbeat("Interrupted by server restart"), name="job-heartbeat"
+    ))
+    background_tasks.append(asyncio.create_task(mcp_sessions.run(), name="mcp-ping"))
+    # Not awaited: the server starts accepting connections meanwhile
+    background_tasks.append(asyncio.create_task(warm_up(), name="warm-up"))
+
+async def warm_up():
+    """Import the backend SDK and initialize tracing once the server is up."""
+    global warmed_up
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(backend.prepare)
+    except Exception as e:
+        logger.error(f"Failed to prepare the '{backend.name}' backend: {e}")
+    await start_telemetry()
+    warmed_up = True
+    logger.info(f"Ready to serve traffic (warm-up took {time.perf_counter() - started:.2f}s)")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    global warmed_up
     logger.info("Shutting down FastAPI server...")
-
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    logger.info(f"Incoming request: {request.method} {request.url}")
-    response = await call_next(request)
-    logger.info(f"Response status: {response.status_code} for {request.method} {request.url}")
-    return response
+    warmed_up = False
+    mcp_sessions.close_all()
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await job_queue.stop()
+    for task in derivative_tasks:
+        task.cancel()
+    if derivative_builder is not None:
+        derivative_builder.stop()
+    upstream.shutdown()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    if asset_store is not None:
+        await asset_store.close()
+    await job_store.close()
 
 @app.get("/")
-async def read_root():
+async def read_root(http_request: Request):
     """Serve the main frontend page"""
-    return FileResponse("static/index.html")
+    response = FileResponse("static/index.html")
+    if INTERACTIVE_TOKEN and not valid_visitor_pass(http_request.cookies.get(INTERACTIVE_COOKIE),
+                                                    client_address(http_request)):
+        # Lets the page's own requests use the interactive priority
+        response.set_cookie(INTERACTIVE_COOKIE, issue_visitor_pass(client_address(http_request)),
+                            max_age=int(INTERACTIVE_PASS_TTL), httponly=True, samesite="strict")
+    return response
 
 @app.get("/health")
 async def health():
-    logger.info("Health check requested")
+    """Liveness: the process is up and serving requests"""
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until the background warm-up has finished"""
+    body = {"status": "ready" if warmed_up else "starting", "telemetry": telemetry_status()}
+    return JSONResponse(body, status_code=200 if warmed_up else 503)
+
+@app.get("/api/stats")
+async def stats():
+    """Job queue, job store, upstream concurrency/queue-wait and result cache counters"""
+    return {
+        "jobs": job_queue.stats(),
+        "store": await job_store.stats(),
+        "upstream": upstream.stats(),
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "imageBatching": image_batcher.stats() if image_batcher is not None else None,
+        "events": job_events.stats(),
+        "mcpSessions": mcp_sessions.stats(),
+        "assets": asset_store.stats() if asset_store is not None else None,
+        "derivatives": derivative_builder.stats() if derivative_builder is not None else None,
+        "logging": logging_stats(),
+        "eventLoop": loop_monitor.stats() if loop_monitor is not None else None
+    }
+
+def require_profiling(http_request: Request):
+    """404 unless PROFILE_TOKEN is set and the request's X-Profile header matches it."""
+    if not profiling_authorized(http_request.headers.get("x-profile")):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/api/debug/profiles/{profile_id}")
+async def get_profile(profile_id: str, http_request: Request):
+    """Folded stacks sampled while a profiled request ran"""
+    require_profiling(http_request)
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if profile["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Request {profile_id} is still running")
+    header = (f"# {profile['method']} {profile['path']}: {profile['durationMs']}ms, "
+              f"{profile['samples']} samples\n")
+    return Response(header + profile["folded"] + "\n", media_type="text/plain")
+
+@app.get("/api/debug/stalls")
+async def get_stalls(http_request: Request):
+    """Recent event loop stalls with the stack that was blocking"""
+    require_profiling(http_request)
+    if loop_monitor is None:
+        return {"stalls": []}
+    return {"stalls": [{**stall, "at": isoformat(stall["at"])} for stall in loop_monitor.stalls]}
+
+# Saturation gauges, read from the components when /metrics is scraped
+Gauge("jobs_running", "Generation jobs running on a worker", callback=lambda: job_queue.stats()["running"])
+Gauge("jobs_queued", "Generation jobs waiting for a worker, by lane and priority", ["kind", "priority"],
+      callback=lambda: job_queue.queued())
+Gauge("upstream_in_flight", "Upstream predictions in progress", ["model"],
+      callback=lambda: {(model, ): s["concurrency"]["inFlight"] for model, s in upstream.state().items()})
+Gauge("upstream_waiting", "Calls waiting for an upstream concurrency slot", ["model"],
+      callback=lambda: {(model, ): s["concurrency"]["waiting"] for model, s in upstream.state().items()})
+Gauge("upstream_concurrency_limit", "Current (adaptive) upstream concurrency limit", ["model"],
+      callback=lambda: {(model, ): s["concurrency"]["limit"] for model, s in upstream.state().items()})
+Gauge("upstream_circuit_open", "1 while a model's circuit breaker rejects calls", ["model"],
+      callback=lambda: {(model, ): int(s["circuit"]["state"] != "closed") for model, s in upstream.state().items()})
+Gauge("event_subscribers", "Connected job status subscribers", callback=lambda: job_events.stats()["subscribers"])
+Gauge("mcp_sessions", "Open MCP SSE sessions", callback=lambda: mcp_sessions.stats()["sessions"])
+Gauge("log_queue_depth", "Log records waiting for the writer thread", callback=lambda: logging_stats()["queued"])
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/api/upstream")
+async def upstream_state():
+    """Adaptive concurrency limit and circuit breaker state per upstream model"""
+    return {"backend": backend.name, "models": upstream.state()}
+
+async def job_snapshot(kind: str, job_id: str) -> Dict[str, Any]:
+    """Current state of a job as a WebSocket message."""
+    record = await job_store.get(kind, job_id)
+    if record is None:
+        return {"type": "notFound", "kind": kind, "id": job_id}
+    return {"type": "status", "kind": kind, **job_status(record)}
+
+# Most job IDs accepted in one WebSocket subscribe or unsubscribe message
+WS_SUBSCRIBE_MAX_IDS = int(os.getenv("WS_SUBSCRIBE_MAX_IDS", 100))
+
+@app.websocket("/ws/jobs")
+async def jobs_websocket(websocket: WebSocket):
+    """Push job status transitions to the client
+
+    Send ``{"action": "subscribe", "imageIds": [...], "videoIds": [...]}`` to
+    follow jobs (``"unsubscribe"`` to stop). The current state of each job is
+    sent straight away, then every transition as it happens.
+    """
+    await websocket.accept()
+    subscription = job_events.subscribe()
+
+    def push(event: Dict[str, Any]) -> bool:
+        """Queue a reply; a client too far behind to take it is disconnected rather than missing it."""
+        if subscription.put(event):
+            return True
+        job_events.evict(subscription)
+        return False
+
+    async def receive():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+            except json.JSONDecodeError:
+                message = None
+            if subscription.evicted:
+                # send() is closing the socket
+                continue
+            if not isinstance(message, dict) or message.get("action") not in ("subscribe", "unsubscribe"):
+                push({"type": "error", "message": "Expected a subscribe or unsubscribe action"})
+                continue
+            ids = [
+                (kind, str(job_id))
+                for kind in ("image", "video")
+                if isinstance(message.get(f"{kind}Ids"), list)
+                for job_id in message[f"{kind}Ids"]
+            ]
+            if len(ids) > WS_SUBSCRIBE_MAX_IDS:
+                push({"type": "error", "message": f"At most {WS_SUBSCRIBE_MAX_IDS} job IDs per message"})
+                continue
+            topics = [job_topic(kind, job_id) for kind, job_id in ids]
+            if message["action"] == "unsubscribe":
+                job_events.remove_topics(subscription, topics)
+                continue
+            # Subscribe before reading the snapshot so no transition is missed in between
+            job_events.add_topics(subscription, topics)
+            for kind, job_id in ids:
+                if not push(await job_snapshot(kind, job_id)):
+                    break
+
+    async def send():
+        while True:
+            event = await subscription.get()
+            if event is None:
+                # Evicted for falling behind; the client reconnects and resubscribes
+                await websocket.close(code=1013, reason="Too slow to read job events")
+                return
+            await websocket.send_json(event)
+
+    tasks = [asyncio.create_task(receive()), asyncio.create_task(send())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.error(f"WebSocket error: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        job_events.unsubscribe(subscription)
+
 @app.post("/api/generate-image", response_model=ImageResponse)
-async def generate_image(request: ImageRequest):
-    """Generate image from text prompt"""
+async def generate_image(request: ImageRequest, http_request: Request,
+                         run_async: bool = Query(False, alias="async")):
+    """Generate image from text prompt
+
+    With ``?async=true`` the job is queued and 202 is returned immediately;
+    follow it on the ``/ws/jobs`` WebSocket or long-poll
+    ``/api/image/{imageId}/status?wait=30``.
+
+    ``X-Priority`` (interactive, normal, batch) and ``X-Client-Id`` set how
+    the job is scheduled against other work.
+    """
     start_time = time.time()
     request_id = f"req_{int(time.time())}"
+    priority, client = job_origin(http_request)
     async def logic():
         try:
-            replicate_token = os.getenv("REPLICATE_API_TOKEN")
-            if not replicate_token:
-                raise HTTPException(status_code=500, detail="REPLICATE_API_TOKEN not found in environment variables")
-            image_id = str(uuid.uuid4()).replace("-", "")[:12]
-            generated_images[image_id] = {
-                "id": image_id,
-                "prompt": request.prompt,
-                "status": "processing",
-                "createdAt": datetime.now().isoformat()
-            }
-            logger.info(f"[{request_id}] Generating image for prompt: {request.prompt}")
-            output = replicate.run(
-                "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-                input={"prompt": request.prompt}
-            )
-            if not output or len(output) == 0:
-                generated_images[image_id]["status"] = "error"
-                generated_images[image_id]["error"] = "No image generated"
-                raise HTTPException(status_code=500, detail="No image generated")
-            image_url = output[0] if isinstance(output, list) else output
-            generated_images[image_id].update({
-                "status": "ready",
-                "imageUrl": image_url,
-                "completedAt": datetime.now().isoformat()
-            })
+            config_error = backend.configuration_error()
+            if config_error:
+                raise HTTPException(status_code=500, detail=config_error)
+            logger.info(f"[{request_id}] Generating image for prompt: {prompt_preview(request.prompt)}")
+            job = await submit_generation("image", request.prompt, priority, client)
+            if run_async and not job.future.done():
+                logger.info(f"[{request_id}] Image job {job.job_id} queued")
+                return JSONResponse(
+                    status_code=202,
+                    content=ImageResponse(
+                        imageId=job.job_id,
+                        status="queued",
+                        message="Image generation queued"
+                    ).model_dump()
+                )
+            # Shielded: the future may be shared with coalesced requests
+            image_url = await asyncio.shield(job.future)
             duration = time.time() - start_time
             logger.info(f"[{request_id}] Image generated successfully in {duration:.2f}s")
             return ImageResponse(
-                imageId=image_id,
+                imageId=job.job_id,
                 imageUrl=image_url,
                 status="ready",
                 message="Image generated successfully"
             )
+        except HTTPException:
+            raise
+        except QueueFullError as e:
+            logger.warning(f"[{request_id}] Rejecting image request: {e}")
+            raise HTTPException(status_code=503, detail=str(e))
+        except JobCancelledError as e:
+            logger.info(f"[{request_id}] {e}")
+            raise HTTPException(status_code=409, detail=str(e))
+        except CircuitOpenError as e:
+            logger.warning(f"[{request_id}] Rejecting image request: {e}")
+            raise HTTPException(status_code=503, detail=str(e),
+                                headers={"Retry-After": str(max(1, round(e.retry_after)))})
         except Exception as e:
             duration = time.time() - start_time
             logger.error(f"[{request_id}] Error generating image after {duration:.2f}s: {str(e)}")
             logger.error(traceback.format_exc())
             raise HTTPException(status_code=500, detail=f"Failed to generate image: {str(e)}")
-    return await trace_operation("generate-image", logic, {"prompt": request.prompt})
+    return await trace_operation("generate-image", logic, {"prompt.length": len(request.prompt), "job.priority": priority})
+
+# Longest a status request may hold waiting for a transition
+STATUS_WAIT_MAX = float(os.getenv("STATUS_WAIT_MAX", 60))
+
+async def wait_for_job(kind: str, job_id: str, wait: float) -> Optional[JobRecord]:
+    """Record of a job, after holding up to ``wait`` seconds for its next
+    status transition if it has not finished yet."""
+    if wait <= 0:
+        return await job_store.get(kind, job_id)
+    # Subscribe before reading so a transition in between still wakes us
+    subscription = job_events.subscribe([job_topic(kind, job_id)])
+    try:
+        record = await job_store.get(kind, job_id)
+        if record is None or record.status in FINISHED_STATUSES:
+            return record
+        try:
+            await asyncio.wait_for(subscription.get(), timeout=min(wait, STATUS_WAIT_MAX))
+        except asyncio.TimeoutError:
+            return record
+        return await job_store.get(kind, job_id)
+    finally:
+        job_events.unsubscribe(subscription)
 
 @app.get("/api/image/{image_id}/status")
-async def get_image_status(image_id: str):
-    """Get the status of a generated image"""
-    if image_id not in generated_images:
+async def get_image_status(image_id: str, wait: float = Query(0, ge=0, le=STATUS_WAIT_MAX)):
+    """Get the status of a generated image
+
+    With ``wait`` (seconds) an unfinished job is held until its status changes
+    or the time runs out, whichever comes first.
+    """
+    image = await wait_for_job("image", image_id, wait)
+    if image is None:
         raise HTTPException(status_code=404, detail="Image not found")
     
-    image = generated_images[image_id]
+    return job_status(image)
+
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 50))
+LIST_PAGE_SIZE_MAX = int(os.getenv("LIST_PAGE_SIZE_MAX", 200))
+
+async def list_jobs(kind: str, limit: int, cursor: Optional[str], status: Optional[str],
+                    created_since: Optional[datetime]) -> Dict[str, Any]:
+    """One page of job summaries, newest first, for the list endpoints."""
+    try:
+        page, next_cursor = await job_store.list_page(
+            kind,
+            limit=limit,
+            cursor=cursor,
+            status=status,
+            created_since=created_since.timestamp() if created_since else None
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
-        "id": image["id"],
-        "status": image["status"],
-        "prompt": image["prompt"],
-        "createdAt": image["createdAt"],
-        "completedAt": image.get("completedAt"),
-        "imageUrl": image.get("imageUrl")
+        f"{kind}s": [
+            {
+                "id": record.id,
+                "status": record.status,
+                "prompt": record.prompt,
+                "createdAt": isoformat(record.created_at),
+                "variants": variant_urls(record.variants)
+            }
+            for record in page
+        ],
+        "nextCursor": next_cursor
     }
 
 @app.get("/api/images")
-async def list_images():
-    """List all generated images"""
-    images = []
-    for image_id, image in generated_images.items():
-        images.append({
-            "id": image["id"],
-            "status": image["status"],
-            "prompt": image["prompt"],
-            "createdAt": image["createdAt"]
-        })
-    
-    return {"images": images}
+async def list_images(
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_since: Optional[datetime] = Query(None, alias="createdSince")
+):
+    """List generated images, newest first
+
+    Pass the returned ``nextCursor`` as ``cursor`` to fetch the next page.
+    """
+    return await list_jobs("image", limit, cursor, status, created_since)
+
+async def cancel_job(kind: str, job_id: str) -> bool:
+    """Stop a job if it is queued or running and delete its record.
+
+    Returns False if there is no such job.
+    """
+    job_queue.cancel(kind, job_id)
+    if not await job_store.delete(kind, job_id):
+        return False
+    job_events.publish(job_topic(kind, job_id), {"type": "deleted", "kind": kind, "id": job_id})
+    return True
 
 @app.delete("/api/image/{image_id}")
 async def delete_image(image_id: str):
-    """Delete a generated image"""
-    if image_id not in generated_images:
+    """Delete a generated image
+
+    A queued or running generation is cancelled first, freeing its slot.
+    """
+    if not await cancel_job("image", image_id):
         raise HTTPException(status_code=404, detail="Image not found")
     
-    del generated_images[image_id]
     return {"success": True}
 
+async def generate_bulk(kind: str, prompts: List[str], priority: str = "batch",
+                        client: str = "anonymous") -> AsyncIterator[Dict[str, Any]]:
+    """Run every prompt through the normal generation path and yield one
+    result per prompt as it finishes (completion order, not input order)."""
+    slots = asyncio.Semaphore(BULK_CONCURRENCY)
+
+    async def run(index: int, prompt: str) -> Dict[str, Any]:
+        result = {"index": index, "prompt": prompt, f"{kind}Id": None}
+        async with slots:
+            try:
+                job = await submit_generation(kind, prompt, priority, client)
+                result[f"{kind}Id"] = job.job_id
+                # Shielded: the future may be shared with coalesced requests
+                url = await asyncio.shield(job.future)
+            except Exception as e:
+                logger.error(f"Bulk {kind} generation failed for prompt {index}: {e}")
+                return {**result, "status": "error", "error": str(e)}
+        return {**result, "status": "ready", f"{kind}Url": url}
+
+    tasks = [asyncio.create_task(run(i, prompt)) for i, prompt in enumerate(prompts)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Client went away: stop submitting the rest (already queued jobs still finish)
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/generate-images")
+async def generate_images(request: BulkImageRequest, http_request: Request):
+    """Generate one image per prompt, streamed as NDJSON
+
+    Each line is ``{"index", "prompt", "imageId", "status", "imageUrl"|"error"}``
+    and is written as soon as that image finishes. Jobs are scheduled at
+    ``batch`` priority unless ``X-Priority`` says otherwise.
+    """
+    priority, client = job_origin(http_request, default_priority="batch")
+    config_error = backend.configuration_error()
+    if config_error:
+        raise HTTPException(status_code=500, detail=config_error)
+    logger.info(f"Bulk generating {len(request.prompts)} images")
+
+    async def lines():
+        async for result in generate_bulk("image", request.prompts, priority, client):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.api_route("/api/assets/{name}", methods=["GET", "HEAD"])
+async def get_asset(name: str, request: Request):
+    """Serve a mirrored output
+
+    Supports ``Range`` requests (for video seeking) and conditional GETs via
+    ``If-None-Match``/``If-Modified-Since``; names are content hashes, so
+    responses are cacheable forever.
+    """
+    if asset_store is None or not ASSET_NAME.match(name):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    stat = await asset_store.open_asset(name)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    return asset_store.response(name, stat, request.method, request.headers)
+
 # Text-to-Video Endpoint
 @app.post("/api/generate-video", response_model=VideoResponse)
-async def generate_video(request: VideoRequest):
+async def generate_video(request: VideoRequest, http_request: Request,
+                         run_async: bool = Query(False, alias="async")):
     start_time = time.time()
     request_id = f"req_{int(time.time())}"
+    priority, client = job_origin(http_request)
     async def logic():
         try:
-            replicate_token = os.getenv("REPLICATE_API_TOKEN")
-            if not replicate_token:
-                raise HTTPException(status_code=500, detail="REPLICATE_API_TOKEN not found in environment variables")
-            video_id = str(uuid.uuid4()).replace("-", "")[:12]
-            generated_videos[video_id] = {
-                "id": video_id,
-                "prompt": request.prompt,
-                "status": "processing",
-                "createdAt": datetime.now().isoformat()
-            }
-            logger.info(f"[{request_id}] Generating video for prompt: {request.prompt}")
-            output = replicate.run(
-                "tencent/hunyuan-video:6c9132aee14409cd6568d030453f1ba50f5f3412b844fe67f78a9eb62d55664f",
-                input={"prompt": request.prompt}
-            )
-            if not output or len(output) == 0:
-                generated_videos[video_id]["status"] = "error"
-                generated_videos[video_id]["error"] = "No video generated"
-                raise HTTPException(status_code=500, detail="No video generated")
-            video_url = output[0] if isinstance(output, list) else output
-            generated_videos[video_id].update({
-                "status": "ready",
-                "videoUrl": video_url,
-                "completedAt": datetime.now().isoformat()
-            })
+            config_error = backend.configuration_error()
+            if config_error:
+                raise HTTPException(status_code=500, detail=config_error)
+            logger.info(f"[{request_id}] Generating video for prompt: {prompt_preview(request.prompt)}")
+            job = await submit_generation("video", request.prompt, priority, client)
+            if run_async and not job.future.done():
+                logger.info(f"[{request_id}] Video job {job.job_id} queued")
+                return JSONResponse(
+                    status_code=202,
+                    content=VideoResponse(
+                        videoId=job.job_id,
+                        status="queued",
+                        message="Video generation queued"
+                    ).model_dump()
+                )
+            # Shielded: the future may be shared with coalesced requests
+            video_url = await asyncio.shield(job.future)
             duration = time.time() - start_time
             logger.info(f"[{request_id}] Video generated successfully in {duration:.2f}s")
             return VideoResponse(
-                videoId=video_id,
+                videoId=job.job_id,
                 videoUrl=video_url,
                 status="ready",
                 message="Video generated successfully"
             )
+        except HTTPException:
+            raise
+        except QueueFullError as e:
+            logger.warning(f"[{request_id}] Rejecting video request: {e}")
+            raise HTTPException(status_code=503, detail=str(e))
+        except JobCancelledError as e:
+            logger.info(f"[{request_id}] {e}")
+            raise HTTPException(status_code=409, detail=str(e))
+        except CircuitOpenError as e:
+            logger.warning(f"[{request_id}] Rejecting video request: {e}")
+            raise HTTPException(status_code=503, detail=str(e),
+                                headers={"Retry-After": str(max(1, round(e.retry_after)))})
         except Exception as e:
             duration = time.time() - start_time
             logger.error(f"[{request_id}] Error generating video after {duration:.2f}s: {str(e)}")
             logger.error(traceback.format_exc())
             raise HTTPException(status_code=500, detail=f"Failed to generate video: {str(e)}")
-    return await trace_operation("generate-video", logic, {"prompt": request.prompt})
+    return await trace_operation("generate-video", logic, {"prompt.length": len(request.prompt), "job.priority": priority})
 
 @app.get("/api/video/{video_id}/status")
-async def get_video_status(video_id: str):
-    if video_id not in generated_videos:
+async def get_video_status(video_id: str, wait: float = Query(0, ge=0, le=STATUS_WAIT_MAX)):
+    video = await wait_for_job("video", video_id, wait)
+    if video is None:
         raise HTTPException(status_code=404, detail="Video not found")
-    video = generated_videos[video_id]
-    return {
-        "id": video["id"],
-        "status": video["status"],
-        "prompt": video["prompt"],
-        "createdAt": video["createdAt"],
-        "completedAt": video.get("completedAt"),
-        "videoUrl": video.get("videoUrl")
-    }
+    return job_status(video)
 
 @app.get("/api/videos")
-async def list_videos():
-    videos = []
-    for video_id, video in generated_videos.items():
-        videos.append({
-            "id": video["id"],
-            "status": video["status"],
-            "prompt": video["prompt"],
-            "createdAt": video["createdAt"]
-        })
-    return {"videos": videos}
+async def list_videos(
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_since: Optional[datetime] = Query(None, alias="createdSince")
+):
+    return await list_jobs("video", limit, cursor, status, created_since)
 
 @app.delete("/api/video/{video_id}")
 async def delete_video(video_id: str):
-    if video_id not in generated_videos:
+    if not await cancel_job("video", video_id):
         raise HTTPException(status_code=404, detail="Video not found")
-    del generated_videos[video_id]
     return {"success": True}
 
-# MCP Server endpoints (following short-video-maker pattern)
+# --- MCP tools ---
+mcp_tools = ToolRegistry()
+mcp_sessions = SessionHub(job_events, mcp_tools)
+
+async def mcp_generate(kind: str, prompt: str, context: ToolContext) -> str:
+    """Generate one output the same way as the REST API and describe the result."""
+    label = kind.capitalize()
+    async def logic():
+        try:
+            job = await submit_generation(kind, prompt, context.priority, context.client)
+            if context.session is not None and not job.future.done():
+                # Status notifications for the job go out on the caller's SSE stream
+                mcp_sessions.watch(context.session, job_topic(kind, job.job_id))
+            # Shielded: the future may be shared with coalesced requests
+            url = await asyncio.shield(job.future)
+        except GenerationError:
+            raise ToolError(f"Error: No {kind} generated")
+        except Exception as e:
+            logger.error(f"Error in MCP generate-{kind}: {str(e)}")
+            raise ToolError(f"Error generating {kind}: {str(e)}")
+        return f"{label} generated successfully! {label} ID: {job.job_id}. {label} URL: {url}"
+    return await trace_operation(f"generate-{kind}", logic,
+                                 {"prompt.length": len(prompt), "job.priority": context.priority})
+
+async def mcp_status(kind: str, job_id: str, wait: Optional[float]) -> str:
+    label = kind.capitalize()
+    record = await wait_for_job(kind, job_id, max(0.0, wait or 0))
+    if record is None:
+        raise ToolError(f"{label} not found")
+    status_text = f"{label} status: {record.status}"
+    if record.url:
+        status_text += f". {label} URL: {public_url(record.url, record.asset)}"
+    return status_text
+
+async def mcp_cancel(kind: str, job_id: str) -> str:
+    label = kind.capitalize()
+    if not await cancel_job(kind, job_id):
+        raise ToolError(f"{label} not found")
+    return f"{label} {job_id} cancelled and deleted"
+
+def id_schema(kind: str, description: str, wait: bool = False) -> Dict[str, Any]:
+    properties = {f"{kind}Id": {"type": "string", "minLength": 1, "description": description}}
+    if wait:
+        properties["wait"] = {
+            "type": "number",
+            "description": f"Seconds to wait for the next status change if the {kind} is not finished (max {STATUS_WAIT_MAX:g})"
+        }
+    return {"type": "object", "properties": properties, "required": [f"{kind}Id"]}
+
+def prompt_schema(description: str) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"prompt": {"type": "string", "minLength": 1, "description": description}},
+        "required": ["prompt"]
+    }
+
+@mcp_tools.tool("generate-image", "Generate an image from a text prompt using Stable Diffusion XL",
+                prompt_schema("The text prompt describing the image you want to generate"))
+async def tool_generate_image(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_generate("image", args["prompt"], context)
+
+@mcp_tools.tool("get-image-status", "Get the status of a generated image",
+                id_schema("image", "The ID of the generated image", wait=True))
+async def tool_get_image_status(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_status("image", args["imageId"], args.get("wait"))
+
+@mcp_tools.tool("cancel-image", "Cancel a queued or running image generation and delete the image",
+                id_schema("image", "The ID of the image to cancel"))
+async def tool_cancel_image(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_cancel("image", args["imageId"])
+
+@mcp_tools.tool("generate-images", "Generate one image per prompt for a batch of prompts", {
+    "type": "object",
+    "properties": {
+        "prompts": {
+            "type": "array",
+            "items": {"type": "string"},
+            "minItems": 1,
+            "maxItems": BULK_MAX_PROMPTS,
+            "description": f"The text prompts, one per image (at most {BULK_MAX_PROMPTS})"
+        }
+    },
+    "required": ["prompts"]
+})
+async def tool_generate_images(args: Dict[str, Any], context: ToolContext) -> str:
+    prompts = args["prompts"]
+    bulk_priority, _ = job_origin(context.request, default_priority="batch")
+    results = [result async for result in generate_bulk("image", prompts, bulk_priority, context.client)]
+    results.sort(key=lambda result: result["index"])
+    ready = sum(1 for result in results if result["status"] == "ready")
+    lines = [f"Generated {ready} of {len(prompts)} images."]
+    for result in results:
+        if result["status"] == "ready":
+            lines.append(f"{result['index'] + 1}. Image ID: {result['imageId']}. Image URL: {result['imageUrl']}")
+        else:
+            lines.append(f"{result['index'] + 1}. Error: {result['error']}")
+    return "\n".join(lines)
+
+@mcp_tools.tool("generate-video", "Generate a video from a text prompt using wavespeedai/wan-2.1-i2v-480p",
+                prompt_schema("The text prompt describing the video you want to generate"))
+async def tool_generate_video(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_generate("video", args["prompt"], context)
+
+@mcp_tools.tool("get-video-status", "Get the status of a generated video",
+                id_schema("video", "The ID of the generated video", wait=True))
+async def tool_get_video_status(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_status("video", args["videoId"], args.get("wait"))
+
+@mcp_tools.tool("cancel-video", "Cancel a queued or running video generation and delete the video",
+                id_schema("video", "The ID of the video to cancel"))
+async def tool_cancel_video(args: Dict[str, Any], context: ToolContext) -> str:
+    return await mcp_cancel("video", args["videoId"])
+
 @app.get("/mcp/sse")
 async def mcp_sse():
-    """Server-Sent Events endpoint for MCP"""
-    async def event_generator():
-        yield "data: {\"type\": \"connected\"}\n\n"
-        
-        # Keep connection alive with periodic pings
-        import asyncio
-        while True:
-            await asyncio.sleep(30)
-            yield "data: {\"type\": \"ping\"}\n\n"
-    
-    from fastapi.responses import StreamingResponse
+    """MCP SSE transport: announces the session's message endpoint, then streams responses and job notifications"""
+    try:
+        session = mcp_sessions.open()
+    except SessionLimitError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     return StreamingResponse(
-        event_generator(),
+        mcp_sessions.stream(session),
         media_type="text/event-stream",
+        # Also releases the slot if the client left before the stream started
+        background=BackgroundTask(mcp_sessions.close, session),
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
         }
     )
 
 @app.post("/mcp/messages")
-async def mcp_messages(request: MCPRequest):
-    """MCP messages endpoint"""
-    if request.method == "tools/list":
-        return MCPResponse(
-            tools=[
-                MCPTool(
-                    name="generate-image",
-                    description="Generate an image from a text prompt using Stable Diffusion XL",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "The text prompt describing the image you want to generate"
-                            }
-                        },
-                        "required": ["prompt"]
-                    }
-                ),
-                MCPTool(
-                    name="get-image-status",
-                    description="Get the status of a generated image",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "imageId": {
-                                "type": "string",
-                                "description": "The ID of the generated image"
-                            }
-                        },
-                        "required": ["imageId"]
-                    }
-                ),
-                MCPTool(
-                    name="generate-video",
-                    description="Generate a video from a text prompt using wavespeedai/wan-2.1-i2v-480p",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "The text prompt describing the video you want to generate"
-                            }
-                        },
-                        "required": ["prompt"]
-                    }
-                ),
-                MCPTool(
-                    name="get-video-status",
-                    description="Get the status of a generated video",
-                    inputSchema={
-                        "type": "object",
-                        "properties": {
-                            "videoId": {
-                                "type": "string",
-                                "description": "The ID of the generated video"
-                            }
-                        },
-                        "required": ["videoId"]
-                    }
-                )
-            ]
-        )
-    
-    elif request.method == "tools/call":
-        tool_name = request.params.get("name")
-        args = request.params.get("arguments", {})
-        
-        if tool_name == "generate-image":
-            # Generate image using the same logic as REST API
-            prompt = args.get("prompt")
-            if not prompt:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Error: Prompt is required"}]
-                )
-            
-            try:
-                # Generate unique ID
-                image_id = str(uuid.uuid4()).replace("-", "")[:12]
-                
-                # Store initial request
-                generated_images[image_id] = {
-                    "id": image_id,
-                    "prompt": prompt,
-                    "status": "processing",
-                    "createdAt": datetime.now().isoformat()
-                }
-                
-                # Call Replicate API
-                async def logic():
-                    output = replicate.run(
-                        "stability-ai/sdxl:39ed52f2a78e934b3ba6e2a89f5b1c712de7dfea535525255b1aa35c5565e08b",
-                        input={"prompt": prompt}
-                    )
-                    
-                    if output and len(output) > 0:
-                        image_url = output[0] if isinstance(output, list) else output
-                        generated_images[image_id].update({
-                            "status": "ready",
-                            "imageUrl": image_url,
-                            "completedAt": datetime.now().isoformat()
-                        })
-                        
-                        return MCPResponse(
-                            content=[
-                                {
-                                    "type": "text",
-                                    "text": f"Image generated successfully! Image ID: {image_id}. Image URL: {image_url}"
-                                }
-                            ]
-                        )
-                    else:
-                        generated_images[image_id]["status"] = "error"
-                        return MCPResponse(
-                            content=[{"type": "text", "text": "Error: No image generated"}]
-                        )
-                
-                return await trace_operation("generate-image", logic, {"prompt": prompt})
-                
-            except Exception as e:
-                logger.error(f"Error in MCP generate-image: {str(e)}")
-                return MCPResponse(
-                    content=[{"type": "text", "text": f"Error generating image: {str(e)}"}]
-                )
-        
-        elif tool_name == "get-image-status":
-            image_id = args.get("imageId")
-            if not image_id:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Error: Image ID is required"}]
-                )
-            
-            if image_id not in generated_images:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Image not found"}]
-                )
-            
-            image = generated_images[image_id]
-            status_text = f"Image status: {image['status']}"
-            if image.get("imageUrl"):
-                status_text += f". Image URL: {image['imageUrl']}"
-            
-            return MCPResponse(
-                content=[{"type": "text", "text": status_text}]
-            )
-        
-        elif tool_name == "generate-video":
-            prompt = args.get("prompt")
-            if not prompt:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Error: Prompt is required"}]
-                )
-            try:
-                video_id = str(uuid.uuid4()).replace("-", "")[:12]
-                generated_videos[video_id] = {
-                    "id": video_id,
-                    "prompt": prompt,
-                    "status": "processing",
-                    "createdAt": datetime.now().isoformat()
-                }
-                async def logic():
-                    output = replicate.run(
-                        "tencent/hunyuan-video:6c9132aee14409cd6568d030453f1ba50f5f3412b844fe67f78a9eb62d55664f",
-                        input={"prompt": prompt}
-                    )
-                    if output and len(output) > 0:
-                        video_url = output[0] if isinstance(output, list) else output
-                        generated_videos[video_id].update({
-                            "status": "ready",
-                            "videoUrl": video_url,
-                            "completedAt": datetime.now().isoformat()
-                        })
-                        return MCPResponse(
-                            content=[
-                                {
-                                    "type": "text",
-                                    "text": f"Video generated successfully! Video ID: {video_id}. Video URL: {video_url}"
-                                }
-                            ]
-                        )
-                    else:
-                        generated_videos[video_id]["status"] = "error"
-                        return MCPResponse(
-                            content=[{"type": "text", "text": "Error: No video generated"}]
-                        )
-                return await trace_operation("generate-video", logic, {"prompt": prompt})
-            except Exception as e:
-                return MCPResponse(
-                    content=[{"type": "text", "text": f"Error generating video: {str(e)}"}]
-                )
-        elif tool_name == "get-video-status":
-            video_id = args.get("videoId")
-            if not video_id:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Error: Video ID is required"}]
-                )
-            if video_id not in generated_videos:
-                return MCPResponse(
-                    content=[{"type": "text", "text": "Video not found"}]
-                )
-            video = generated_videos[video_id]
-            status_text = f"Video status: {video['status']}"
-            if video.get("videoUrl"):
-                status_text += f". Video URL: {video['videoUrl']}"
-            return MCPResponse(
-                content=[{"type": "text", "text": status_text}]
-            )
-        
-        else:
-            return MCPResponse(
-                content=[{"type": "text", "text": f"Unknown tool: {tool_name}"}]
-            )
-    
-    else:
-        return MCPResponse(
-            content=[{"type": "text", "text": f"Unknown method: {request.method}"}]
-        )
+async def mcp_messages(http_request: Request, sessionId: Optional[str] = None):
+    """MCP messages endpoint: JSON-RPC 2.0 requests and batches, or the plain {method, params} form.
+
+    With ``sessionId`` the message is accepted (202) and answered on that session's SSE stream."""
+    priority, client = job_origin(http_request)
+    context = ToolContext(priority=priority, client=client, request=http_request)
+    if sessionId is not None:
+        session = mcp_sessions.get(sessionId)
+        if session is None:
+            raise HTTPException(status_code=404, detail="MCP session not found")
+        mcp_sessions.submit(session, await http_request.body(), context)
+        return Response(status_code=202)
+    body = await mcp_tools.handle(await http_request.body(), context)
+    if body is None:
+        # Only notifications
+        return Response(status_code=202)
+    return Response(body, media_type="application/json")
 
 # Add a test endpoint for tracing
 from fastapi import APIRouter
@@ -592,4 +1124,5 @@ app.include_router(router)
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 3123))
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # Access records come from AccessLogMiddleware; uvicorn's loggers feed the queue
+    uvicorn.run(app, host="0.0.0.0", port=port, log_config=None, access_log=False)
\ No newline at end of file
@@ -0,0 +1,465 @@
+"""
+MCP tool registry and message handling.
+
+Tools are declared once with ``ToolRegistry.tool``: name, description,
+input schema and handler. The schema is compiled into a validator when the
+tool is registered, so arguments are checked before the handler runs, and
+the ``tools/list`` result is serialized once and reused for every call.
+
+``ToolRegistry.handle`` takes the raw body of ``/mcp/messages``:
+
+- a JSON-RPC 2.0 request, or a batch array of them; the calls in a batch
+  run concurrently and each response carries its request's ``id``
+  (notifications, i.e. requests without an ``id``, get none)
+- the original ``{"method", "params"}`` form, answered in the original
+  ``{"tools", "content"}`` shape
+
+``SessionHub`` implements the MCP HTTP+SSE transport: a client opens
+``/mcp/sse``, learns its message endpoint from the first event, and
+receives the responses to what it posts there over the stream, together
+with status notifications for the jobs its tool calls started. Sessions
+are subscriptions on the job EventBroadcaster, so they share its bounded
+queues and slow-consumer eviction, and one timer task keeps every idle
+stream alive.
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Union
+
+from app.events import EventBroadcaster, Subscription, job_topic
+from app.metrics import MCP_TOOL_CALLS
+
+logger = logging.getLogger(__name__)
+
+# Most messages accepted in one JSON-RPC batch
+MCP_BATCH_MAX = int(os.getenv("MCP_BATCH_MAX", 50))
+# Seconds between keep-alive comments on idle SSE streams
+MCP_SSE_PING_INTERVAL = float(os.getenv("MCP_SSE_PING_INTERVAL", 15))
+MCP_SSE_MAX_SESSIONS = int(os.getenv("MCP_SSE_MAX_SESSIONS", 10000))
+
+MCP_PROTOCOL_VERSION = "2024-11-05"
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+
+class ToolError(Exception):
+    """Raised by a tool handler; the message is returned to the caller as an error result."""
+
+
+@dataclass
+class ToolContext:
+    """Request-level details tool handlers may need."""
+    priority: str
+    client: str
+    request: Any = None
+    # SSE session the call arrived on, if any
+    session: Optional["MCPSession"] = None
+
+
+ToolResult = Union[str, List[Dict[str, Any]]]
+ToolHandler = Callable[[Dict[str, Any], ToolContext], Awaitable[ToolResult]]
+
+_JSON_TYPES = {
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+
+def compile_schema(schema: Dict[str, Any], path: str = "arguments") -> Callable[[Any], Optional[str]]:
+    """
+    Build a validator for the JSON Schema subset the tools use.
+
+    Supports ``type``, ``properties``, ``required``, ``items``,
+    ``minLength``/``maxLength``, ``minItems``/``maxItems`` and
+    ``minimum``/``maximum``; other keywords are ignored. The validator
+    returns an error message, or None if the value is valid.
+    """
+    checks: List[Callable[[Any], Optional[str]]] = []
+    expected = schema.get("type")
+    if expected is not None:
+        types = _JSON_TYPES[expected]
+
+        def check_type(value):
+            # bool is an int subclass but not a JSON number
+            if not isinstance(value, types) or (isinstance(value, bool) and expected != "boolean"):
+                return f"{path} must be of type {expected}"
+        checks.append(check_type)
+    for keyword, describe in (("minLength", "at least {} characters"), ("maxLength", "at most {} characters"),
+                              ("minItems", "at least {} items"), ("maxItems", "at most {} items")):
+        if keyword in schema:
+            limit = schema[keyword]
+            minimum = keyword.startswith("min")
+
+            def check_size(value, limit=limit, minimum=minimum, describe=describe):
+                if isinstance(value, (str, list)) and (len(value) < limit if minimum else len(value) > limit):
+                    if minimum and limit == 1:
+                        return f"{path} must not be empty"
+                    return f"{path} must have {describe.format(limit)}"
+            checks.append(check_size)
+    for keyword in ("minimum", "maximum"):
+        if keyword in schema:
+            limit = schema[keyword]
+            minimum = keyword == "minimum"
+
+            def check_range(value, limit=limit, minimum=minimum):
+                if isinstance(value, (int, float)) and (value < limit if minimum else value > limit):
+                    return f"{path} must be {'at least' if minimum else 'at most'} {limit:g}"
+            checks.append(check_range)
+    if "items" in schema:
+        validate_item = compile_schema(schema["items"], f"{path} items")
+
+        def check_items(value):
+            if isinstance(value, list):
+                for item in value:
+                    error = validate_item(item)
+                    if error:
+                        return error
+        checks.append(check_items)
+    required = tuple(schema.get("required", ()))
+    properties = {
+        name: compile_schema(subschema, name) for name, subschema in schema.get("properties", {}).items()
+    }
+    if required or properties:
+        def check_object(value):
+            if not isinstance(value, dict):
+                return None
+            for name in required:
+                if value.get(name) is None:
+                    return f"{name} is required"
+            for name, validate in properties.items():
+                if value.get(name) is not None:
+                    error = validate(value[name])
+                    if error:
+                        return error
+        checks.append(check_object)
+
+    def validate(value: Any) -> Optional[str]:
+        for check in checks:
+            error = check(value)
+            if error:
+                return error
+        return None
+    return validate
+
+
+@dataclass
+class Tool:
+    name: str
+    description: str
+    input_schema: Dict[str, Any]
+    handler: ToolHandler
+    validate: Callable[[Any], Optional[str]]
+
+
+def _content(result: ToolResult) -> List[Dict[str, Any]]:
+    return [{"type": "text", "text": result}] if isinstance(result, str) else result
+
+
+def _jsonrpc_result(request_id: Any, result_json: str) -> str:
+    return f'{{"jsonrpc":"2.0","id":{json.dumps(request_id)},"result":{result_json}}}'
+
+
+def _jsonrpc_error(request_id: Any, code: int, message: str) -> str:
+    return json.dumps({"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}})
+
+
+class ToolRegistry:
+    """
+    Declared MCP tools and the dispatch of MCP messages to them.
+
+    Args:
+        name: Server name reported to ``initialize``
+        version: Server version reported to ``initialize``
+    """
+
+    def __init__(self, name: str = "text-to-image", version: str = "1.0.0"):
+        self._server_info = {"name": name, "version": version}
+        self._tools: Dict[str, Tool] = {}
+        self._list_result: Optional[str] = None
+        self._list_legacy: Optional[str] = None
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def tool(self, name: str, description: str, input_schema: Dict[str, Any]):
+        """Decorator registering ``handler(arguments, context)`` as tool ``name``."""
+        def register(handler: ToolHandler) -> ToolHandler:
+            if name in self._tools:
+                raise ValueError(f"MCP tool '{name}' is already registered")
+            self._tools[name] = Tool(name, description, input_schema, handler, compile_schema(input_schema))
+            self._list_result = self._list_legacy = None
+            return handler
+        return register
+
+    def prepare(self):
+        """Serialize the tools/list response; done on first use if not called."""
+        tools = [
+            {"name": tool.name, "description": tool.description, "inputSchema": tool.input_schema}
+            for tool in self._tools.values()
+        ]
+        self._list_result = json.dumps({"tools": tools})
+        self._list_legacy = json.dumps({"tools": tools, "content": None})
+
+    def _count_call(self, name: Any):
+        MCP_TOOL_CALLS.labels(name if name in self._tools else "unknown").inc()
+
+    async def call(self, name: str, arguments: Dict[str, Any], context: ToolContext) -> Dict[str, Any]:
+        """
+        Validate the arguments and run a tool.
+
+        Returns:
+            ``{"content": [...], "isError": bool}``
+
+        Raises:
+            KeyError: If no tool is called ``name``
+        """
+        tool = self._tools[name]
+        error = tool.validate(arguments)
+        if error:
+            return {"content": _content(f"Error: {error}"), "isError": True}
+        try:
+            return {"content": _content(await tool.handler(arguments, context)), "isError": False}
+        except ToolError as e:
+            return {"content": _content(str(e)), "isError": True}
+
+    async def handle(self, body: bytes, context: ToolContext) -> Optional[str]:
+        """
+        Answer the body of an MCP messages request.
+
+        Returns:
+            The JSON response, or None if nothing needs answering (only
+            notifications)
+        """
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return _jsonrpc_error(None, PARSE_ERROR, "Parse error")
+        if isinstance(payload, list):
+            if not payload:
+                return _jsonrpc_error(None, INVALID_REQUEST, "Empty batch")
+            if len(payload) > MCP_BATCH_MAX:
+                return _jsonrpc_error(None, INVALID_REQUEST, f"At most {MCP_BATCH_MAX} messages per batch")
+            responses = await asyncio.gather(*(self._handle_jsonrpc(message, context) for message in payload))
+            responses = [response for response in responses if response is not None]
+            return f"[{','.join(responses)}]" if responses else None
+        if isinstance(payload, dict) and "jsonrpc" not in payload:
+            return await self._handle_legacy(payload, context)
+        return await self._handle_jsonrpc(payload, context)
+
+    async def _handle_jsonrpc(self, message: Any, context: ToolContext) -> Optional[str]:
+        if not isinstance(message, dict) or message.get("jsonrpc") != "2.0" or not isinstance(message.get("method"), str):
+            return _jsonrpc_error(message.get("id") if isinstance(message, dict) else None,
+                                  INVALID_REQUEST, "Invalid Request")
+        request_id = message.get("id")
+        notification = "id" not in message
+        try:
+            response = await self._dispatch_jsonrpc(request_id, message["method"], message.get("params") or {}, context)
+        except Exception as e:
+            logger.error(f"MCP {message['method']} failed: {e}")
+            response = _jsonrpc_error(request_id, INTERNAL_ERROR, str(e))
+        return None if notification else response
+
+    async def _dispatch_jsonrpc(self, request_id: Any, method: str, params: Any, context: ToolContext) -> str:
+        if method == "initialize":
+            return _jsonrpc_result(request_id, json.dumps({
+                "protocolVersion": MCP_PROTOCOL_VERSION,
+                "capabilities": {"tools": {}, "logging": {}},
+                "serverInfo": self._server_info,
+            }))
+        if method == "ping":
+            return _jsonrpc_result(request_id, "{}")
+        if method == "tools/list":
+            if self._list_result is None:
+                self.prepare()
+            return _jsonrpc_result(request_id, self._list_result)
+        if method == "tools/call":
+            name = params.get("name") if isinstance(params, dict) else None
+            name = name if isinstance(name, str) else None
+            self._count_call(name)
+            if name not in self._tools:
+                return _jsonrpc_error(request_id, INVALID_PARAMS, f"Unknown tool: {name}")
+            result = await self.call(name, params.get("arguments") or {}, context)
+            return _jsonrpc_result(request_id, json.dumps(result))
+        return _jsonrpc_error(request_id, METHOD_NOT_FOUND, f"Method not found: {method}")
+
+    async def _handle_legacy(self, message: Dict[str, Any], context: ToolContext) -> str:
+        method = message.get("method")
+        params = message.get("params")
+        params = params if isinstance(params, dict) else {}
+        if method == "tools/list":
+            if self._list_legacy is None:
+                self.prepare()
+            return self._list_legacy
+        if method == "tools/call":
+            name = params.get("name")
+            name = name if isinstance(name, str) else None
+            self._count_call(name)
+            if name not in self._tools:
+                content = _content(f"Unknown tool: {name}")
+            else:
+                content = (await self.call(name, params.get("arguments") or {}, context))["content"]
+        else:
+            content = _content(f"Unknown method: {method}")
+        return json.dumps({"tools": None, "content": content})
+
+
+class SessionLimitError(Exception):
+    """Raised when a new SSE session would exceed MCP_SSE_MAX_SESSIONS."""
+
+
+class MCPSession:
+    """One SSE connection and its event subscription."""
+
+    def __init__(self, session_id: str, subscription: Subscription):
+        self.id = session_id
+        self.subscription = subscription
+
+
+# Job statuses after which a session stops following the job
+_FINAL_STATUSES = ("ready", "error")
+
+
+class SessionHub:
+    """
+    MCP sessions over Server-Sent Events.
+
+    Every session subscribes to its own topic (responses to its messages),
+    to a shared ping topic and to the topics of the jobs it started. A
+    session whose queue fills up because the client is not reading is
+    evicted by the broadcaster and its stream ends.
+
+    Args:
+        broadcaster: The job status broadcaster
+        registry: Answers the messages posted to a session
+        endpoint: Path clients post their messages to
+        ping_interval: Seconds between keep-alive comments
+        max_sessions: Open sessions before new ones are refused
+    """
+
+    PING_TOPIC = "mcp:ping"
+    _PING = {"type": "ping"}
+
+    def __init__(self, broadcaster: EventBroadcaster, registry: ToolRegistry, endpoint: str = "/mcp/messages",
+                 ping_interval: float = MCP_SSE_PING_INTERVAL, max_sessions: int = MCP_SSE_MAX_SESSIONS):
+        self._broadcaster = broadcaster
+        self._registry = registry
+        self._endpoint = endpoint
+        self._ping_interval = ping_interval
+        self._max_sessions = max_sessions
+        self._sessions: Dict[str, MCPSession] = {}
+        # Messages being answered; also keeps their tasks referenced
+        self._pending: Set[asyncio.Task] = set()
+        self._opened = 0
+        self._messages = 0
+
+    @staticmethod
+    def _topic(session_id: str) -> str:
+        return f"mcp:{session_id}"
+
+    def get(self, session_id: str) -> Optional[MCPSession]:
+        return self._sessions.get(session_id)
+
+    def open(self) -> MCPSession:
+        """
+        Register a session, taking its slot at once; pass it to ``stream``.
+
+        Raises:
+            SessionLimitError: If MCP_SSE_MAX_SESSIONS sessions are open
+        """
+        if len(self._sessions) >= self._max_sessions:
+            raise SessionLimitError(f"Too many MCP sessions ({self._max_sessions} open)")
+        session_id = uuid.uuid4().hex
+        subscription = self._broadcaster.subscribe([self._topic(session_id), self.PING_TOPIC])
+        session = self._sessions[session_id] = MCPSession(session_id, subscription)
+        self._opened += 1
+        return session
+
+    def close(self, session: MCPSession):
+        """Release the session's slot and end its stream; safe to call more than once."""
+        # Calls still running are left to finish: cancelling one would cancel
+        # the job future it awaits. Their responses go to a topic nobody reads.
+        if self._sessions.pop(session.id, None) is not None:
+            self._broadcaster.close(session.subscription)
+
+    def watch(self, session: MCPSession, topic: str):
+        """Forward the events of ``topic`` (a job) to the session until the job finishes."""
+        if session.id in self._sessions:
+            self._broadcaster.add_topics(session.subscription, [topic])
+
+    def submit(self, session: MCPSession, body: bytes, context: ToolContext):
+        """Handle a posted message in the background; its response goes out on the stream."""
+        context.session = session
+        task = asyncio.create_task(self._answer(session, body, context))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _answer(self, session: MCPSession, body: bytes, context: ToolContext):
+        try:
+            response = await self._registry.handle(body, context)
+        except Exception as e:
+            logger.error(f"MCP session {session.id} message failed: {e}")
+            response = _jsonrpc_error(None, INTERNAL_ERROR, str(e))
+        if response is not None:
+            self._messages += 1
+            self._broadcaster.publish(self._topic(session.id), {"type": "mcp", "data": response})
+
+    async def stream(self, session: MCPSession) -> AsyncIterator[str]:
+        """Yield the SSE stream of an opened session until the client leaves or is evicted; then close it."""
+        try:
+            yield f"event: endpoint\ndata: {self._endpoint}?sessionId={session.id}\n\n"
+            while True:
+                event = await session.subscription.get()
+                if event is None:
+                    # Evicted as a slow consumer, or the server is shutting down
+                    break
+                kind = event.get("type")
+                if kind == "ping":
+                    yield ": ping\n\n"
+                elif kind == "mcp":
+                    yield f"event: message\ndata: {event['data']}\n\n"
+                else:
+                    if kind == "deleted" or event.get("status") in _FINAL_STATUSES:
+                        self._broadcaster.remove_topics(session.subscription, [job_topic(event["kind"], event["id"])])
+                    notification = {
+                        "jsonrpc": "2.0",
+                        "method": "notifications/message",
+                        "params": {"level": "info", "logger": "jobs", "data": event},
+                    }
+                    yield f"event: message\ndata: {json.dumps(notification, default=str)}\n\n"
+        finally:
+            self.close(session)
+
+    async def run(self):
+        """Keep every idle stream alive from a single timer."""
+        while True:
+            await asyncio.sleep(self._ping_interval)
+            if self._sessions:
+                self._broadcaster.publish(self.PING_TOPIC, self._PING)
+
+    def close_all(self):
+        """End every stream, e.g. on shutdown."""
+        for session in list(self._sessions.values()):
+            self.close(session)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "opened": self._opened,
+            "pendingCalls": len(self._pending),
+            "messagesSent": self._messages,
+            "maxSessions": self._max_sessions,
+        }
@@ -0,0 +1,246 @@
+"""
+Flow control for upstream calls.
+
+- ``AdaptiveLimiter``: a concurrency limit that adapts AIMD-style. It grows
+  by one slot per limit's worth of successful calls and is cut
+  multiplicatively when the upstream throttles us or its latency climbs
+  well above its long-run average.
+- ``CircuitBreaker``: after repeated transient failures, calls fail fast
+  for a cool-off period; then a single probe call decides whether to close
+  the circuit again.
+- ``backoff_delay``: exponential backoff with full jitter for retries.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_ADAPTIVE = os.getenv("UPSTREAM_ADAPTIVE", "true").lower() == "true"
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", 1))
+# Multiplier applied to the limit on throttling or a latency spike
+UPSTREAM_DECREASE_FACTOR = float(os.getenv("UPSTREAM_DECREASE_FACTOR", 0.5))
+# Minimum seconds between two decreases, so one burst of 429s cuts the limit once
+UPSTREAM_DECREASE_INTERVAL = float(os.getenv("UPSTREAM_DECREASE_INTERVAL", 5))
+# Recent latency above this multiple of the long-run average counts as congestion
+UPSTREAM_LATENCY_TOLERANCE = float(os.getenv("UPSTREAM_LATENCY_TOLERANCE", 2))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 3))
+UPSTREAM_RETRY_BASE = float(os.getenv("UPSTREAM_RETRY_BASE", 0.5))
+UPSTREAM_RETRY_MAX = float(os.getenv("UPSTREAM_RETRY_MAX", 20))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))
+
+# Latency samples needed before latency can trigger a decrease
+_LATENCY_WARMUP = 10
+
+
+def backoff_delay(attempt: int, base: float = UPSTREAM_RETRY_BASE, cap: float = UPSTREAM_RETRY_MAX) -> float:
+    """Seconds to wait before retry number ``attempt`` (1-based): full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adjusted by additive increase / multiplicative decrease.
+
+    Args:
+        limit: Initial and maximum number of concurrent calls
+        min_limit: The limit never drops below this
+        adaptive: If False the limit stays fixed at ``limit``
+        decrease_factor: Multiplier applied on throttling or congestion
+        decrease_interval: Minimum seconds between decreases
+        latency_tolerance: Short-term/long-term latency ratio treated as congestion
+    """
+
+    def __init__(self, limit: int, min_limit: int = UPSTREAM_MIN_CONCURRENCY,
+                 adaptive: bool = UPSTREAM_ADAPTIVE,
+                 decrease_factor: float = UPSTREAM_DECREASE_FACTOR,
+                 decrease_interval: float = UPSTREAM_DECREASE_INTERVAL,
+                 latency_tolerance: float = UPSTREAM_LATENCY_TOLERANCE):
+        self.max_limit = limit
+        self.min_limit = min(min_limit, limit)
+        self.limit = float(limit)
+        self.in_flight = 0
+        self._adaptive = adaptive
+        self._decrease_factor = decrease_factor
+        self._decrease_interval = decrease_interval
+        self._latency_tolerance = latency_tolerance
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = float("-inf")
+        self._latency_short: Optional[float] = None
+        self._latency_long: Optional[float] = None
+        self._samples = 0
+        self.increases = 0
+        self.decreases = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as we were cancelled: pass it on
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def on_success(self, latency: float):
+        """Record a successful call and how long it took."""
+        if self._latency_long is None:
+            self._latency_short = self._latency_long = latency
+        else:
+            self._latency_short += 0.3 * (latency - self._latency_short)
+            self._latency_long += 0.02 * (latency - self._latency_long)
+        self._samples += 1
+        if not self._adaptive:
+            return
+        if self._samples >= _LATENCY_WARMUP and self._latency_short > self._latency_tolerance * self._latency_long:
+            self._decrease("latency")
+        elif self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+            self._wake()
+
+    def on_throttle(self):
+        """Record a throttled (429) call."""
+        if self._adaptive:
+            self._decrease("throttled")
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self._decrease_interval:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(float(self.min_limit), self.limit * self._decrease_factor)
+        if self.limit < previous:
+            self.decreases += 1
+            logger.warning(f"Upstream {reason}: concurrency limit {previous:.1f} -> {self.limit:.1f}")
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "maxLimit": self.max_limit,
+            "minLimit": self.min_limit,
+            "adaptive": self._adaptive,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "recentLatencyMs": round(self._latency_short * 1000, 1) if self._latency_short is not None else None,
+            "baselineLatencyMs": round(self._latency_long * 1000, 1) if self._latency_long is not None else None,
+        }
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive failures; open ->
+    half-open after ``reset_seconds``, where one probe call is let through.
+
+    Args:
+        name: Used in error messages and logs
+        failure_threshold: Consecutive failures that open the circuit
+        reset_seconds: How long the circuit stays open before probing
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def check(self):
+        """Raise CircuitOpenError while the circuit is open and not yet due a probe."""
+        if self.state == self.OPEN:
+            remaining = self._opened_at + self._reset_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpenError(f"Upstream {self.name} is unavailable; retry in {remaining:.0f}s", remaining)
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead now."""
+        self.check()
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit for {self.name} half-open: probing")
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                raise CircuitOpenError(f"Upstream {self.name} is being probed; retry shortly", 1.0)
+            self._probing = True
+
+    def on_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.name} closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def on_failure(self):
+        self.consecutive_failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self._failure_threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+                logger.error(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def on_neutral(self):
+        """A call ended without telling us anything about upstream health."""
+        self._probing = False
+
+    def stats(self) -> dict:
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = round(max(0.0, self._opened_at + self._reset_seconds - time.monotonic()), 1)
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.consecutive_failures,
+            "failureThreshold": self._failure_threshold,
+            "resetSeconds": self._reset_seconds,
+            "retryInSeconds": retry_in,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
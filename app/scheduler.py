@@ -0,0 +1,227 @@
+"""
+Scheduling of queued generation jobs onto the worker pool.
+
+Jobs are held in separate lanes per output kind (``image`` / ``video``).
+Each lane may occupy at most its share of the workers, so minutes-long
+video jobs cannot take every slot from cheap image jobs; a free worker
+takes from the eligible lane using the smallest fraction of its share.
+Within a lane:
+
+- priorities are strict: ``interactive`` before ``normal`` before ``batch``
+- within a priority, clients share the lane by weighted fair queuing
+  (self-clocked: each job is tagged with a virtual finish time of
+  ``1 / weight`` after its client's previous job, and the smallest tag
+  runs first), so one client submitting hundreds of jobs only delays its
+  own work
+- ``reserved`` workers (none by default) only ever run interactive jobs,
+  so the frontend stays responsive while API and bulk traffic saturate the
+  rest; they sit idle when there is no interactive work
+"""
+
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = ("interactive", "normal", "batch")
+DEFAULT_PRIORITY = "normal"
+
+# Workers each lane may occupy; 0 means all of them
+IMAGE_LANE_WORKERS = int(os.getenv("IMAGE_LANE_WORKERS", 0))
+# Default: half of the workers (at least one)
+VIDEO_LANE_WORKERS = int(os.getenv("VIDEO_LANE_WORKERS", 0))
+# Workers kept free for interactive jobs; off by default, since a reserved
+# worker stays idle while only API traffic is queued
+INTERACTIVE_RESERVED_WORKERS = int(os.getenv("INTERACTIVE_RESERVED_WORKERS", 0))
+# Comma-separated ``client=weight`` pairs; unlisted clients have weight 1
+CLIENT_WEIGHTS = os.getenv("CLIENT_WEIGHTS", "")
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """Parse ``client=weight`` pairs, e.g. ``"frontend=4,partner-a=2"``."""
+    weights = {}
+    for pair in filter(None, (part.strip() for part in spec.split(","))):
+        client, _, weight = pair.rpartition("=")
+        if not client or float(weight) <= 0:
+            raise ValueError(f"Invalid client weight: {pair}")
+        weights[client] = float(weight)
+    return weights
+
+
+class _Entry:
+    __slots__ = ("job", "finish")
+
+    def __init__(self, job: Any, finish: float):
+        self.job = job
+        self.finish = finish
+
+
+class FairScheduler:
+    """
+    Holds queued jobs and hands the next one to an idle worker.
+
+    Jobs need ``kind``, ``priority`` and ``client`` attributes.
+
+    Args:
+        workers: Size of the worker pool drawing from the scheduler
+        lane_limits: Maximum running jobs per kind
+        reserved: Workers that only run interactive jobs
+        weights: Fair-share weight per client identity (default 1)
+    """
+
+    def __init__(self, workers: int, lane_limits: Optional[Dict[str, int]] = None,
+                 reserved: int = INTERACTIVE_RESERVED_WORKERS,
+                 weights: Optional[Dict[str, float]] = None):
+        if lane_limits is None:
+            lane_limits = {
+                "image": IMAGE_LANE_WORKERS or workers,
+                "video": VIDEO_LANE_WORKERS or max(1, workers // 2),
+            }
+        self._workers = workers
+        self._lane_limits = {lane: min(limit, workers) for lane, limit in lane_limits.items()}
+        # Never reserve every worker, or non-interactive jobs would never run
+        self._reserved = min(reserved, workers - 1)
+        self._weights = weights if weights is not None else parse_weights(CLIENT_WEIGHTS)
+        # lane -> priority -> client -> queued entries in submission order
+        self._queues: Dict[str, Dict[str, Dict[str, Deque[_Entry]]]] = {
+            lane: {priority: {} for priority in PRIORITIES} for lane in self._lane_limits
+        }
+        # Fair-queuing clock and each client's latest finish tag, per lane and priority
+        self._virtual_time = {lane: {priority: 0.0 for priority in PRIORITIES} for lane in self._lane_limits}
+        self._last_finish: Dict[str, Dict[str, Dict[str, float]]] = {
+            lane: {priority: {} for priority in PRIORITIES} for lane in self._lane_limits
+        }
+        self._running = {lane: 0 for lane in self._lane_limits}
+        self._running_interactive = 0
+        self._size = 0
+        self._waiters: List[asyncio.Future] = []
+        self._dispatched = {priority: 0 for priority in PRIORITIES}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def put(self, job: Any):
+        """Queue a job; it is tagged relative to its client's earlier jobs."""
+        if job.priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{job.priority}' (expected one of: {', '.join(PRIORITIES)})")
+        last_finish = self._last_finish[job.kind][job.priority]
+        start = max(self._virtual_time[job.kind][job.priority], last_finish.get(job.client, 0.0))
+        finish = start + 1.0 / self._weights.get(job.client, 1.0)
+        last_finish[job.client] = finish
+        clients = self._queues[job.kind][job.priority]
+        clients.setdefault(job.client, deque()).append(_Entry(job, finish))
+        self._size += 1
+        self._wake()
+
+    def remove(self, job: Any) -> bool:
+        """Take a queued job out of the scheduler; returns False if it is not queued."""
+        clients = self._queues[job.kind][job.priority]
+        entries = clients.get(job.client)
+        if entries is None:
+            return False
+        for entry in entries:
+            if entry.job is job:
+                entries.remove(entry)
+                break
+        else:
+            return False
+        if not entries:
+            del clients[job.client]
+        self._size -= 1
+        return True
+
+    async def get(self) -> Any:
+        """Wait until a job may start on the calling worker and return it."""
+        while True:
+            job = self._next()
+            if job is not None:
+                return job
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def done(self, job: Any):
+        """Tell the scheduler a job returned by ``get`` has finished."""
+        self._running[job.kind] -= 1
+        if job.priority == "interactive":
+            self._running_interactive -= 1
+        self._wake()
+
+    def _wake(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+    def _next(self) -> Optional[Any]:
+        running = sum(self._running.values())
+        for priority in PRIORITIES:
+            if priority != "interactive" and running - self._running_interactive >= self._workers - self._reserved:
+                # Only the reserved workers are left
+                return None
+            lanes = [
+                lane for lane, limit in self._lane_limits.items()
+                if self._running[lane] < limit and self._queues[lane][priority]
+            ]
+            if lanes:
+                lane = min(lanes, key=lambda lane: self._running[lane] / self._lane_limits[lane])
+                entries = min(self._queues[lane][priority].values(), key=lambda entries: entries[0].finish)
+                return self._dispatch(entries)
+        return None
+
+    def _dispatch(self, entries: Deque[_Entry]) -> Any:
+        entry = entries.popleft()
+        job = entry.job
+        if not entries:
+            del self._queues[job.kind][job.priority][job.client]
+        self._virtual_time[job.kind][job.priority] = entry.finish
+        last_finish = self._last_finish[job.kind][job.priority]
+        if last_finish.get(job.client, 0.0) <= entry.finish:
+            # Nothing of this client is tagged beyond the clock any more
+            last_finish.pop(job.client, None)
+        self._size -= 1
+        self._running[job.kind] += 1
+        if job.priority == "interactive":
+            self._running_interactive += 1
+        self._dispatched[job.priority] += 1
+        return job
+
+    def queued(self) -> Dict[Tuple[str, str], int]:
+        """Number of queued jobs per (lane, priority)."""
+        return {
+            (lane, priority): sum(len(entries) for entries in entries_by_client.values())
+            for lane, priorities in self._queues.items()
+            for priority, entries_by_client in priorities.items()
+        }
+
+    def stats(self) -> dict:
+        clients = set()
+        queued = {priority: 0 for priority in PRIORITIES}
+        lanes = {}
+        for lane, priorities in self._queues.items():
+            lane_queued = 0
+            for priority, entries_by_client in priorities.items():
+                count = sum(len(entries) for entries in entries_by_client.values())
+                queued[priority] += count
+                lane_queued += count
+                clients.update(entries_by_client)
+            lanes[lane] = {
+                "running": self._running[lane],
+                "limit": self._lane_limits[lane],
+                "queued": lane_queued,
+            }
+        return {
+            "lanes": lanes,
+            "queuedByPriority": queued,
+            "dispatchedByPriority": dict(self._dispatched),
+            "reservedInteractive": self._reserved,
+            "runningInteractive": self._running_interactive,
+            "queuedClients": len(clients),
+        }
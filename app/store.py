@@ -0,0 +1,502 @@
+"""
+Persistent job store.
+
+Image and video job records live in an SQLite database in WAL mode instead
+of process memory, so they survive restarts and memory use does not grow
+with the number of jobs ever run. All database access happens on a single
+dedicated thread; callers use the async methods.
+
+Records are returned as compact ``JobRecord`` tuples with epoch-second
+timestamps and interned ``kind``/``status`` strings. Finished jobs are
+evicted by age and by total count according to the retention policy.
+
+Several server processes may share one database. Each store registers an
+instance row, refreshes its heartbeat every JOB_HEARTBEAT_SECONDS and
+stamps the jobs it creates with its instance ID, so only the unfinished
+jobs of instances that stopped (or stopped heartbeating) are failed, never
+those another live process is still running.
+"""
+
+import os
+import sys
+import time
+import uuid
+import base64
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "output/jobs.sqlite3")
+# Finished jobs older than this many seconds are evicted (0 keeps them forever)
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+# At most this many finished jobs are kept, newest first (0 means no limit)
+JOB_RETENTION_MAX = int(os.getenv("JOB_RETENTION_MAX", 100000))
+JOB_RETENTION_SWEEP_SECONDS = float(os.getenv("JOB_RETENTION_SWEEP_SECONDS", 60))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 10))
+# An instance whose heartbeat is older than this is presumed dead
+JOB_INSTANCE_TIMEOUT = float(os.getenv("JOB_INSTANCE_TIMEOUT", 30))
+
+STATUSES = ("queued", "processing", "ready", "error")
+UNFINISHED_STATUSES = ("queued", "processing")
+FINISHED_STATUSES = ("ready", "error")
+KINDS = ("image", "video")
+
+# Map every status/kind read from the database onto one shared string object
+_INTERNED = {value: sys.intern(value) for value in STATUSES + KINDS}
+
+
+class JobRecord(NamedTuple):
+    id: str
+    kind: str
+    prompt: str
+    status: str
+    created_at: float
+    started_at: Optional[float] = None
+    completed_at: Optional[float] = None
+    url: Optional[str] = None
+    error: Optional[str] = None
+    queue_wait_ms: Optional[float] = None
+    cached: bool = False
+    shared_with: Optional[str] = None
+    # Name of the output in the local asset store, once mirrored
+    asset: Optional[str] = None
+    # Derived files (thumbnail, webp, ...) as variant name -> asset name
+    variants: Optional[Dict[str, str]] = None
+
+
+_RECORD_COLUMNS = JobRecord._fields
+_SUMMARY_COLUMNS = ("id", "kind", "prompt", "status", "created_at", "variants")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    completed_at REAL,
+    url TEXT,
+    error TEXT,
+    queue_wait_ms REAL,
+    cached INTEGER NOT NULL DEFAULT 0,
+    shared_with TEXT,
+    asset TEXT,
+    variants TEXT,
+    owner TEXT
+);
+CREATE TABLE IF NOT EXISTS instances (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS jobs_kind_created ON jobs (kind, created_at);
+CREATE INDEX IF NOT EXISTS jobs_kind_status_created ON jobs (kind, status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_prompt_hash ON jobs (prompt_hash);
+"""
+
+# Columns added after the first release, created on databases that predate them
+_ADDED_COLUMNS = {"asset": "TEXT", "variants": "TEXT", "owner": "TEXT"}
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+def encode_cursor(created_at: float, job_id: str) -> str:
+    raw = f"{created_at!r}:{job_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, job_id = raw.split(":", 1)
+        return float(created_at), job_id
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursorError("Invalid cursor")
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+
+
+def _select(columns: Tuple[str, ...]) -> str:
+    return ", ".join(columns)
+
+
+def _column_value(field: str, value: Any) -> Any:
+    """Convert a JobRecord field value to its database representation."""
+    if field == "cached":
+        return int(value)
+    if field == "variants" and value is not None:
+        return json.dumps(value, separators=(",", ":"))
+    return value
+
+
+def _record(row: tuple, columns: Tuple[str, ...] = _RECORD_COLUMNS) -> JobRecord:
+    """Build a JobRecord from a row selected with ``columns``."""
+    values = dict(zip(columns, row))
+    values["kind"] = _INTERNED.get(values["kind"], values["kind"])
+    values["status"] = _INTERNED.get(values["status"], values["status"])
+    if "cached" in values:
+        values["cached"] = bool(values["cached"])
+    if values.get("variants") is not None:
+        values["variants"] = json.loads(values["variants"])
+    return JobRecord(**values)
+
+
+def record_size(record: JobRecord) -> int:
+    """Approximate bytes held by a record, not counting shared interned strings."""
+    size = sys.getsizeof(record)
+    for value in record:
+        if value is None or isinstance(value, bool) or (isinstance(value, str) and value in _INTERNED):
+            continue
+        size += sys.getsizeof(value)
+    return size
+
+
+def _dict_size(record: JobRecord) -> int:
+    """Bytes the same record would take as a dict with ISO timestamp strings."""
+    as_dict = {
+        field: (time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(value)) + ".000000"
+                if field.endswith("_at") and value is not None else value)
+        for field, value in record._asdict().items()
+    }
+    return sys.getsizeof(as_dict) + sum(
+        sys.getsizeof(value) for value in as_dict.values() if value is not None and not isinstance(value, bool)
+    )
+
+
+class JobStore:
+    """
+    SQLite-backed store of job records.
+
+    Args:
+        path: Database file; ":memory:" keeps it in memory (tests, benchmarks)
+        retention_seconds: Maximum age of finished jobs (0 disables)
+        retention_max: Maximum number of finished jobs kept (0 disables)
+        instance_timeout: Seconds without a heartbeat after which another
+            instance's unfinished jobs are failed
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH,
+                 retention_seconds: float = JOB_RETENTION_SECONDS,
+                 retention_max: int = JOB_RETENTION_MAX,
+                 instance_timeout: float = JOB_INSTANCE_TIMEOUT):
+        self._path = path
+        self._retention_seconds = retention_seconds
+        self._retention_max = retention_max
+        self._instance_timeout = instance_timeout
+        # Stamped on every job this process creates
+        self.instance_id = uuid.uuid4().hex
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._evicted = 0
+
+    # --- Lifecycle ---
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        await self._call(self._open)
+        logger.info(f"Job store opened at {self._path}")
+
+    def _open(self):
+        if self._path != ":memory:" and os.path.dirname(self._path):
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        now = time.time()
+        self._conn.execute(
+            "INSERT INTO instances (id, pid, started_at, heartbeat) VALUES (?, ?, ?, ?)",
+            (self.instance_id, os.getpid(), now, now),
+        )
+        self._conn.commit()
+
+    def _close(self):
+        # Leaving marks this instance dead, so its unfinished jobs get failed
+        self._conn.execute("DELETE FROM instances WHERE id = ?", (self.instance_id,))
+        self._conn.commit()
+        self._conn.close()
+
+    async def close(self):
+        if self._conn is not None:
+            await self._call(self._close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Queries ---
+
+    async def create(self, record: JobRecord):
+        await self._call(self._create, record)
+
+    def _create(self, record: JobRecord):
+        row = {field: _column_value(field, value) for field, value in record._asdict().items()}
+        row["prompt_hash"] = prompt_hash(record.prompt)
+        row["owner"] = self.instance_id
+        placeholders = ", ".join("?" for _ in row)
+        self._conn.execute(f"INSERT INTO jobs ({', '.join(row)}) VALUES ({placeholders})", tuple(row.values()))
+        self._conn.commit()
+
+    async def get(self, kind: str, job_id: str) -> Optional[JobRecord]:
+        return await self._call(self._get, kind, job_id)
+
+    def _get(self, kind: str, job_id: str):
+        row = self._conn.execute(
+            f"SELECT {_select(_RECORD_COLUMNS)} FROM jobs WHERE id = ? AND kind = ?", (job_id, kind)
+        ).fetchone()
+        return _record(row) if row else None
+
+    async def update(self, kind: str, job_ids: Iterable[str], fields: Dict[str, Any]):
+        """Apply ``fields`` (JobRecord field names) to every listed job of ``kind`` that still exists."""
+        await self._call(self._update, kind, list(job_ids), fields)
+
+    def _update(self, kind: str, job_ids: List[str], fields: Dict[str, Any]):
+        if not job_ids or not fields:
+            return
+        unknown = set(fields) - set(JobRecord._fields)
+        if unknown:
+            raise ValueError(f"Unknown job record fields: {', '.join(sorted(unknown))}")
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        values = [_column_value(field, value) for field, value in fields.items()]
+        placeholders = ", ".join("?" for _ in job_ids)
+        self._conn.execute(
+            f"UPDATE jobs SET {assignments} WHERE kind = ? AND id IN ({placeholders})",
+            (*values, kind, *job_ids),
+        )
+        self._conn.commit()
+
+    async def link_follower(self, kind: str, job_id: str, leader_id: str):
+        """Point ``job_id`` at ``leader_id`` and copy the leader's current progress."""
+        await self._call(self._link_follower, kind, job_id, leader_id)
+
+    def _link_follower(self, kind: str, job_id: str, leader_id: str):
+        self._conn.execute(
+            "UPDATE jobs SET shared_with = :leader, "
+            "status = COALESCE((SELECT status FROM jobs WHERE id = :leader AND kind = :kind), status), "
+            "started_at = (SELECT started_at FROM jobs WHERE id = :leader AND kind = :kind) "
+            "WHERE id = :id AND kind = :kind",
+            {"leader": leader_id, "kind": kind, "id": job_id},
+        )
+        self._conn.commit()
+
+    async def delete(self, kind: str, job_id: str) -> bool:
+        return await self._call(self._delete, kind, job_id)
+
+    def _delete(self, kind: str, job_id: str) -> bool:
+        deleted = self._conn.execute(
+            "DELETE FROM jobs WHERE id = ? AND kind = ?", (job_id, kind)
+        ).rowcount
+        self._conn.commit()
+        return deleted > 0
+
+    async def exists_any(self, kind: str, job_ids: Iterable[str]) -> bool:
+        return await self._call(self._exists_any, kind, list(job_ids))
+
+    def _exists_any(self, kind: str, job_ids: List[str]) -> bool:
+        placeholders = ", ".join("?" for _ in job_ids)
+        row = self._conn.execute(
+            f"SELECT 1 FROM jobs WHERE kind = ? AND id IN ({placeholders}) LIMIT 1", (kind, *job_ids)
+        ).fetchone()
+        return row is not None
+
+    async def list_page(self, kind: str, limit: int, cursor: Optional[str] = None,
+                        status: Optional[str] = None,
+                        created_since: Optional[float] = None) -> Tuple[List[JobRecord], Optional[str]]:
+        """
+        Return one page of job summaries, newest first.
+
+        Summaries only carry ``id``, ``kind``, ``prompt``, ``status``,
+        ``created_at`` and ``variants``; the remaining fields are left at
+        their defaults.
+
+        Args:
+            kind: "image" or "video"
+            limit: Maximum number of records in the page
+            cursor: ``nextCursor`` from the previous page, if any
+            status: Only return jobs in this status
+            created_since: Only return jobs created at or after this timestamp
+
+        Returns:
+            The page of records and the cursor for the next page (None at the end)
+
+        Raises:
+            InvalidCursorError: If ``cursor`` was not produced by this method
+        """
+        return await self._call(self._list_page, kind, limit, cursor, status, created_since)
+
+    def _list_page(self, kind, limit, cursor, status, created_since):
+        clauses = ["kind = ?"]
+        params: List[Any] = [kind]
+        if status is not None:
+            clauses.append("status = ?")
+            params.append(status)
+        if created_since is not None:
+            clauses.append("created_at >= ?")
+            params.append(created_since)
+        if cursor is not None:
+            created_at, job_id = decode_cursor(cursor)
+            clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params.extend([created_at, created_at, job_id])
+        rows = self._conn.execute(
+            f"SELECT {_select(_SUMMARY_COLUMNS)} FROM jobs WHERE " + " AND ".join(clauses) +
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        page = [_record(row, _SUMMARY_COLUMNS) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor(last.created_at, last.id)
+        return page, next_cursor
+
+    async def fail_unfinished(self, error: str, completed_at: float) -> int:
+        """
+        Mark jobs left queued/processing by dead instances as failed.
+
+        An instance is dead once it has closed its store or its heartbeat is
+        older than ``instance_timeout``; jobs from before instances were
+        recorded have no owner and count as dead too. Jobs of this and every
+        other live instance are left alone.
+        """
+        return await self._call(self._fail_unfinished, error, completed_at)
+
+    def _fail_unfinished(self, error: str, completed_at: float) -> int:
+        cutoff = time.time() - self._instance_timeout
+        count = self._conn.execute(
+            "UPDATE jobs SET status = 'error', error = ?, completed_at = ? "
+            "WHERE status IN (?, ?) AND (owner IS NULL OR owner NOT IN "
+            "(SELECT id FROM instances WHERE heartbeat >= ? OR id = ?))",
+            (error, completed_at, *UNFINISHED_STATUSES, cutoff, self.instance_id),
+        ).rowcount
+        self._conn.execute("DELETE FROM instances WHERE heartbeat < ? AND id != ?", (cutoff, self.instance_id))
+        self._conn.commit()
+        return count
+
+    async def heartbeat(self):
+        await self._call(self._heartbeat, time.time())
+
+    def _heartbeat(self, now: float):
+        updated = self._conn.execute(
+            "UPDATE instances SET heartbeat = ? WHERE id = ?", (now, self.instance_id)
+        ).rowcount
+        if not updated:
+            # Presumed dead by another instance after a long stall; register again
+            self._conn.execute(
+                "INSERT INTO instances (id, pid, started_at, heartbeat) VALUES (?, ?, ?, ?)",
+                (self.instance_id, os.getpid(), now, now),
+            )
+        self._conn.commit()
+
+    async def run_heartbeat(self, error: str, interval: float = JOB_HEARTBEAT_SECONDS):
+        """
+        Refresh this instance's heartbeat every ``interval`` seconds until
+        cancelled, failing the unfinished jobs of instances that died since.
+
+        Args:
+            error: Error message given to the failed jobs
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.heartbeat()
+                failed = await self.fail_unfinished(error, time.time())
+            except sqlite3.Error as e:
+                logger.error(f"Job store heartbeat failed: {e}")
+                continue
+            if failed:
+                logger.warning(f"Marked {failed} unfinished jobs of a stopped server process as failed")
+
+    # --- Retention ---
+
+    async def evict_finished(self, now: Optional[float] = None) -> int:
+        """Apply the retention policy to finished jobs; returns the number evicted."""
+        evicted = await self._call(self._evict_finished, now or time.time())
+        self._evicted += evicted
+        if evicted:
+            logger.info(f"Evicted {evicted} finished jobs from the job store")
+        return evicted
+
+    def _evict_finished(self, now: float) -> int:
+        evicted = 0
+        if self._retention_seconds > 0:
+            evicted += self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND completed_at < ?",
+                (*FINISHED_STATUSES, now - self._retention_seconds),
+            ).rowcount
+        if self._retention_max > 0:
+            evicted += self._conn.execute(
+                "DELETE FROM jobs WHERE id IN ("
+                "SELECT id FROM jobs WHERE status IN (?, ?) "
+                "ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (*FINISHED_STATUSES, self._retention_max),
+            ).rowcount
+        self._conn.commit()
+        return evicted
+
+    async def run_retention(self, interval: float = JOB_RETENTION_SWEEP_SECONDS):
+        """Evict finished jobs every ``interval`` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_finished()
+            except sqlite3.Error as e:
+                logger.error(f"Job retention sweep failed: {e}")
+
+    # --- Introspection ---
+
+    async def count(self, kind: Optional[str] = None) -> int:
+        return await self._call(self._count, kind)
+
+    def _count(self, kind: Optional[str]) -> int:
+        if kind is None:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = ?", (kind,)).fetchone()[0]
+
+    async def stats(self, sample: int = 100) -> dict:
+        """Job counts, on-disk size, retention settings and per-record memory."""
+        return await self._call(self._stats, sample)
+
+    def _stats(self, sample: int) -> dict:
+        by_status = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+        records = [_record(row) for row in self._conn.execute(
+            f"SELECT {_select(_RECORD_COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (sample,)
+        )]
+        live_instances = self._conn.execute(
+            "SELECT COUNT(*) FROM instances WHERE heartbeat >= ?", (time.time() - self._instance_timeout,)
+        ).fetchone()[0]
+        return {
+            "instance": self.instance_id,
+            "liveInstances": live_instances,
+            "stored": sum(by_status.values()),
+            "byStatus": by_status,
+            "databaseBytes": page_count * page_size,
+            "retentionSeconds": self._retention_seconds,
+            "retentionMax": self._retention_max,
+            "evicted": self._evicted,
+            "avgRecordBytes": round(sum(map(record_size, records)) / len(records), 1) if records else None,
+            "avgDictRecordBytes": round(sum(map(_dict_size, records)) / len(records), 1) if records else None,
+        }
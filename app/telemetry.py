@@ -0,0 +1,176 @@
+"""
+Tracing setup and spans.
+
+langtrace, and the OpenTelemetry SDK and instrumentations it brings in,
+account for most of the server's import time, so they are not imported
+with the app. ``start_telemetry`` initializes langtrace on a worker thread
+once the server is already answering requests; until then, or when
+LANGTRACE_API_KEY is not set, ``tracing_enabled()`` is False and
+operations run untraced.
+
+Traces are sampled at the root (``traced``): an operation left out by
+TRACE_SAMPLE_RATE creates no spans at all, and its children are skipped
+because their parent is None. Span helpers never raise: a tracing failure
+is logged and the traced work carries on untraced.
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import traceback
+import contextlib
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+LANGTRACE_API_KEY = os.getenv("LANGTRACE_API_KEY")
+# Fraction of root operations traced (head sampling)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+
+# Set together once langtrace is initialized
+_tracer = None
+_otel_trace = None
+_otel_context = None
+
+# Root span of the operation running in the current task, if sampled
+_current_span: ContextVar[Any] = ContextVar("current_span", default=None)
+
+# "pending" until start_telemetry runs, then "starting" and one of
+# "enabled", "disabled" (no API key) or "failed"
+_status = "pending"
+
+
+def _init_langtrace():
+    global _tracer, _otel_trace, _otel_context
+    from langtrace_python_sdk import langtrace
+    from opentelemetry import context, trace
+    langtrace.init(api_key=LANGTRACE_API_KEY)
+    _otel_trace = trace
+    _otel_context = context
+    _tracer = trace.get_tracer("text-to-image")
+
+
+async def start_telemetry():
+    """Initialize langtrace without blocking the event loop; never raises."""
+    global _status
+    if not LANGTRACE_API_KEY:
+        _status = "disabled"
+        logger.warning("LANGTRACE_API_KEY not set. langtrace is disabled.")
+        return
+    _status = "starting"
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_init_langtrace)
+    except Exception as e:
+        _status = "failed"
+        logger.error(f"Failed to initialize langtrace: {e}")
+        logger.error(traceback.format_exc())
+        return
+    _status = "enabled"
+    logger.info(f"langtrace initialized in {time.perf_counter() - started:.2f}s")
+
+
+def tracing_enabled() -> bool:
+    return _status == "enabled"
+
+
+def telemetry_status() -> str:
+    return _status
+
+
+def current_span() -> Any:
+    """Root span of the operation in progress, to parent work done elsewhere."""
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def traced(name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """
+    Run the body inside a sampled root span, made current for the task.
+
+    Yields the span, or None if tracing is off or the operation was not
+    sampled. Exceptions from the body are recorded on the span and
+    re-raised unchanged.
+    """
+    span = None
+    if tracing_enabled() and random.random() < TRACE_SAMPLE_RATE:
+        try:
+            span = _tracer.start_span(name, attributes=attributes)
+            token = _otel_context.attach(_otel_trace.set_span_in_context(span))
+        except Exception as e:
+            logger.warning(f"Could not start span '{name}': {e}")
+            end_span(span)
+            span = None
+    if span is None:
+        yield None
+        return
+    span_token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        end_span(span, e)
+        raise
+    else:
+        end_span(span)
+    finally:
+        _current_span.reset(span_token)
+        try:
+            _otel_context.detach(token)
+        except Exception:
+            pass
+
+
+def start_span(name: str, parent: Any, attributes: Optional[Dict[str, Any]] = None,
+               start_time: Optional[int] = None) -> Any:
+    """
+    Start a child of ``parent``; returns None (and traces nothing) if
+    ``parent`` is None. End it with ``end_span``.
+
+    Args:
+        start_time: Epoch nanoseconds, for phases that began earlier
+    """
+    if parent is None or _tracer is None:
+        return None
+    try:
+        return _tracer.start_span(name, context=_otel_trace.set_span_in_context(parent),
+                                  attributes=attributes, start_time=start_time)
+    except Exception as e:
+        logger.warning(f"Could not start span '{name}': {e}")
+        return None
+
+
+def end_span(span: Any, error: Optional[BaseException] = None, end_time: Optional[int] = None):
+    """End a span from ``start_span`` or ``traced``, marking it failed if ``error`` is set."""
+    if span is None:
+        return
+    try:
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(_otel_trace.Status(_otel_trace.StatusCode.ERROR, str(error) or type(error).__name__))
+        span.end(end_time=end_time)
+    except Exception as e:
+        logger.warning(f"Could not end span: {e}")
+
+
+def record_span(name: str, parent: Any, duration: float, attributes: Optional[Dict[str, Any]] = None):
+    """Record a child span for a phase that just ended after ``duration`` seconds."""
+    if parent is None:
+        return
+    end = time.time_ns()
+    end_span(start_span(name, parent, attributes, start_time=end - int(duration * 1e9)), end_time=end)
+
+
+@contextlib.contextmanager
+def child_span(name: str, parent: Any, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    """``start_span`` / ``end_span`` around the body; yields the span or None."""
+    span = start_span(name, parent, attributes)
+    try:
+        yield span
+    except BaseException as e:
+        end_span(span, e)
+        raise
+    else:
+        end_span(span)
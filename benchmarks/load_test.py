@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Load-generation benchmark
+=========================
+
+Drives the API with many concurrent clients and reports latency percentiles,
+throughput and error rates per operation.
+
+By default the app is run in-process with the offline fake backend
+(GENERATION_BACKEND=fake), so no network access or Replicate spend is
+involved. Pass --url to benchmark a running server instead.
+
+Requires httpx (``pip install httpx``).
+
+Examples:
+    python benchmarks/load_test.py --concurrency 500 --duration 30
+    python benchmarks/load_test.py --mix generate=1,status=5,list=1,mcp=1 --output results.json
+    python benchmarks/load_test.py --url http://localhost:3123 --concurrency 100
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+OPERATIONS = ("generate", "status", "list", "mcp")
+
+
+def parse_mix(spec):
+    """Parse ``op=weight,...`` into a dict of weights."""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation '{name}' (expected one of {OPERATIONS})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LoadTest:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.status_codes = defaultdict(lambda: defaultdict(int))
+        self.image_ids = []
+        self.ops, self.weights = zip(*args.mix.items())
+
+    def prompt(self):
+        return f"benchmark prompt {random.randrange(self.args.prompt_pool)}"
+
+    async def generate(self):
+        params = {"async": "true"} if self.args.async_mode else None
+        response = await self.client.post("/api/generate-image", json={"prompt": self.prompt()}, params=params)
+        if response.status_code in (200, 202):
+            self.image_ids.append(response.json()["imageId"])
+        return response
+
+    async def status(self):
+        if not self.image_ids:
+            return await self.list()
+        image_id = random.choice(self.image_ids)
+        return await self.client.get(f"/api/image/{image_id}/status")
+
+    async def list(self):
+        return await self.client.get("/api/images")
+
+    async def mcp(self):
+        if self.image_ids and random.random() < 0.5:
+            payload = {
+                "method": "tools/call",
+                "params": {"name": "get-image-status", "arguments": {"imageId": random.choice(self.image_ids)}}
+            }
+        else:
+            payload = {"method": "tools/list"}
+        return await self.client.post("/mcp/messages", json=payload)
+
+    async def client_loop(self, deadline):
+        while time.perf_counter() < deadline:
+            op = random.choices(self.ops, self.weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(self, op)()
+                code = response.status_code
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            finished = time.perf_counter()
+            # Only requests that completed inside the window count toward the report
+            if finished > deadline:
+                break
+            self.latencies[op].append(finished - start)
+            self.status_codes[op][str(code)] += 1
+            if not isinstance(code, int) or code >= 400:
+                self.errors[op] += 1
+
+    async def run(self):
+        """Run the clients for the configured duration and return it.
+
+        Requests still in flight at the deadline are cancelled rather than
+        awaited, so throughput is always measured over exactly --duration.
+        """
+        deadline = time.perf_counter() + self.args.duration
+        tasks = [asyncio.create_task(self.client_loop(deadline)) for _ in range(self.args.concurrency)]
+        _, pending = await asyncio.wait(tasks, timeout=self.args.duration)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return self.args.duration
+
+    def report(self, elapsed):
+        operations = {}
+        for op, values in sorted(self.latencies.items()):
+            values.sort()
+            operations[op] = {
+                "requests": len(values),
+                "errors": self.errors[op],
+                "errorRate": round(self.errors[op] / len(values), 4),
+                "throughputRps": round(len(values) / elapsed, 2),
+                "p50Ms": round(percentile(values, 50) * 1000, 2),
+                "p95Ms": round(percentile(values, 95) * 1000, 2),
+                "p99Ms": round(percentile(values, 99) * 1000, 2),
+                "maxMs": round(values[-1] * 1000, 2),
+                "statusCodes": dict(self.status_codes[op]),
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "operations": operations,
+            "total": {
+                "requests": total,
+                "errors": sum(self.errors.values()),
+                "throughputRps": round(total / elapsed, 2),
+                "elapsedSeconds": round(elapsed, 2),
+            },
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    print(f"{'operation':<10} {'reqs':>8} {'err%':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for op, stats in report["operations"].items():
+        print(f"{op:<10} {stats['requests']:>8} {stats['errorRate'] * 100:>6.2f}% {stats['throughputRps']:>9.1f} "
+              f"{stats['p50Ms']:>9.1f} {stats['p95Ms']:>9.1f} {stats['p99Ms']:>9.1f}")
+    total = report["total"]
+    print(f"\nTotal: {total['requests']} requests, {total['errors']} errors, "
+          f"{total['throughputRps']:.1f} req/s over {total['elapsedSeconds']}s")
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    timeout = httpx.Timeout(args.timeout)
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout)
+        app = None
+    else:
+        os.environ.setdefault("GENERATION_BACKEND", "fake")
+        os.environ.setdefault("FAKE_IMAGE_LATENCY", "lognormal:0.5:0.3")
+        os.environ.setdefault("RESULT_CACHE_PATH", "")
+        os.environ.setdefault("JOB_STORE_PATH", ":memory:")
+        from app.main import app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   limits=limits, timeout=timeout)
+
+    try:
+        test = LoadTest(client, args)
+        print(f"Running {args.concurrency} clients for {args.duration}s against "
+              f"{args.url or 'in-process app (fake backend)'} with mix {args.mix}")
+        elapsed = await test.run()
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    report = test.report(elapsed)
+    print_report(report)
+    if args.output:
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {
+                "url": args.url,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "mix": args.mix,
+                "async": args.async_mode,
+                "promptPool": args.prompt_pool,
+                "backend": None if args.url else os.environ.get("GENERATION_BACKEND"),
+            },
+            **report,
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--concurrency", type=int, default=100, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("generate=1,status=4,list=1,mcp=1"),
+                        help="Operation weights, e.g. generate=1,status=4,list=1,mcp=1")
+    parser.add_argument("--async", dest="async_mode", action="store_true",
+                        help="Submit generations with ?async=true")
+    parser.add_argument("--prompt-pool", type=int, default=1000,
+                        help="Number of distinct prompts (smaller means more cache hits)")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-request timeout in seconds")
+    parser.add_argument("--output", help="Write machine-readable JSON results to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Logging overhead benchmark
+==========================
+
+Measures what logging costs per request: the in-process app (fake backend)
+serves the same request sequentially with logging enabled as configured and
+with logging switched off, in alternating rounds, and the difference in mean
+latency is the per-request overhead of the log pipeline (middleware access
+log, endpoint logs, formatting and file/console output).
+
+Console output is sent to /dev/null so terminal speed does not dominate;
+the log file is written as configured (LOG_FILE).
+
+Requires httpx (``pip install httpx``).
+
+Examples:
+    python benchmarks/logging_bench.py
+    python benchmarks/logging_bench.py --requests 20000 --path /api/image/missing/status --output logging.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import statistics
+import subprocess
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def timed_round(client, path, requests):
+    started = time.perf_counter()
+    for _ in range(requests):
+        await client.get(path)
+    return (time.perf_counter() - started) / requests
+
+
+async def main(args):
+    os.environ.setdefault("GENERATION_BACKEND", "fake")
+    os.environ.setdefault("RESULT_CACHE_PATH", "")
+    os.environ.setdefault("JOB_STORE_PATH", ":memory:")
+    os.environ.setdefault("ASSET_MIRROR_ENABLED", "false")
+    os.environ.setdefault("DERIVATIVES_ENABLED", "false")
+    devnull = open(os.devnull, "w")
+    # Keep the console handler's cost out of the terminal
+    sys.stderr = devnull
+    from app.main import app
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.StreamHandler) and getattr(handler, "stream", None) is sys.__stderr__:
+            handler.setStream(devnull)
+    # The benchmark's own client would otherwise log every request
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    await app.router.startup()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    timings = {"enabled": [], "disabled": []}
+    try:
+        if args.warmup:
+            await timed_round(client, args.path, args.warmup)
+        for _ in range(args.rounds):
+            for mode in ("enabled", "disabled"):
+                logging.disable(logging.CRITICAL if mode == "disabled" else logging.NOTSET)
+                timings[mode].append(await timed_round(client, args.path, args.requests // args.rounds))
+        logging.disable(logging.NOTSET)
+    finally:
+        await client.aclose()
+        await app.router.shutdown()
+        sys.stderr = sys.__stderr__
+
+    enabled = statistics.median(timings["enabled"]) * 1e6
+    disabled = statistics.median(timings["disabled"]) * 1e6
+    report = {
+        "enabledUs": round(enabled, 1),
+        "disabledUs": round(disabled, 1),
+        "overheadUs": round(enabled - disabled, 1),
+        "overheadPct": round((enabled - disabled) / disabled * 100, 1),
+    }
+    print(f"GET {args.path}: {report['enabledUs']:.1f} us/request with logging, "
+          f"{report['disabledUs']:.1f} us without -> {report['overheadUs']:.1f} us "
+          f"({report['overheadPct']:.1f}%) per request")
+    if args.output:
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {"path": args.path, "requests": args.requests, "rounds": args.rounds},
+            **report,
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/health", help="Path requested in every round")
+    parser.add_argument("--requests", type=int, default=10000, help="Requests per mode")
+    parser.add_argument("--rounds", type=int, default=10, help="Alternating enabled/disabled rounds")
+    parser.add_argument("--warmup", type=int, default=500, help="Requests before measuring")
+    parser.add_argument("--output", help="Write machine-readable JSON results to this file")
+    asyncio.run(main(parser.parse_args()))
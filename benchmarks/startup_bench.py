@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark
+======================
+
+Measures how quickly a fresh server process becomes useful, which is what
+cold starts on Railway cost us:
+
+- import: time to ``import app.main`` in a fresh interpreter
+- first response: from spawning ``python main.py`` to the first 200 from
+  ``/health`` (liveness)
+- ready: from spawning to the first 200 from ``/ready``, i.e. after the
+  backend SDK and langtrace have been loaded in the background
+
+Each figure is the median over ``--runs`` fresh processes. The server uses
+the fake backend and throwaway stores; LANGTRACE_API_KEY and
+GENERATION_BACKEND are taken from the environment, so the cost of tracing
+setup can be compared with and without a key.
+
+Examples:
+    python benchmarks/startup_bench.py
+    LANGTRACE_API_KEY=... python benchmarks/startup_bench.py --runs 10 --output startup.json
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_env(workdir, port=None):
+    env = dict(os.environ)
+    env.setdefault("GENERATION_BACKEND", "fake")
+    env.update({
+        "PYTHONPATH": ROOT,
+        "JOB_STORE_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "RESULT_CACHE_PATH": os.path.join(workdir, "cache.sqlite3"),
+        "ASSET_DIR": os.path.join(workdir, "assets"),
+        "LOG_FILE": "",
+    })
+    if port is not None:
+        env["PORT"] = str(port)
+    return env
+
+
+def measure_import(workdir):
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT,
+                                     env=server_env(workdir), stderr=subprocess.DEVNULL, text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def wait_for(url, process, started, timeout):
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"No 200 from {url} within {timeout}s")
+
+
+def measure_server(workdir, timeout):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=server_env(workdir, port),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        first_response = wait_for(f"http://127.0.0.1:{port}/health", process, started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", process, started, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return first_response, ready
+
+
+def main(args):
+    timings = {"import": [], "firstResponse": [], "ready": []}
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            timings["import"].append(measure_import(workdir))
+            first_response, ready = measure_server(workdir, args.timeout)
+        timings["firstResponse"].append(first_response)
+        timings["ready"].append(ready)
+        print(f"run {run + 1}: import {timings['import'][-1] * 1000:.0f} ms, "
+              f"first response {first_response * 1000:.0f} ms, ready {ready * 1000:.0f} ms")
+
+    report = {name: round(statistics.median(values) * 1000, 1) for name, values in timings.items()}
+    print(f"median: import {report['import']:.0f} ms, first response {report['firstResponse']:.0f} ms, "
+          f"ready {report['ready']:.0f} ms")
+    if args.output:
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "config": {
+                "runs": args.runs,
+                "backend": os.getenv("GENERATION_BACKEND", "fake"),
+                "langtrace": bool(os.getenv("LANGTRACE_API_KEY")),
+            },
+            "medianMs": report,
+            "runsMs": {name: [round(v * 1000, 1) for v in values] for name, values in timings.items()},
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh server processes to start")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for each endpoint")
+    parser.add_argument("--output", help="Write machine-readable JSON results to this file")
+    main(parser.parse_args())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Derivative transcode benchmark
+==============================
+
+Measures how fast the derivative pipeline (app/derivatives.py) turns
+full-size images into their thumbnail/WebP/AVIF variants, per format on a
+single core and end to end across process pools of increasing size.
+
+Source images are synthetic 1024x1024 PNGs (SDXL's output size) with
+gradients, shapes and noise, so encoders see realistic entropy.
+
+Requires Pillow (``pip install Pillow``).
+
+Examples:
+    python benchmarks/transcode_bench.py
+    python benchmarks/transcode_bench.py --images 64 --workers 1,2,4,8 --output transcode.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.derivatives import build_image_variants, detect_options, _encode  # noqa: E402
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_source(path, size, seed):
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randrange(20, size // 4)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    noise = Image.effect_noise((size, size), 40).convert("RGB")
+    image = Image.blend(image.filter(ImageFilter.GaussianBlur(2)), noise, 0.15)
+    image.save(path, format="PNG")
+
+
+def per_format(sources, options):
+    """Single-core encode time of each variant, in milliseconds per image."""
+    formats = {"thumbnail": None}
+    if options.webp:
+        formats["webp"] = ("WEBP", {"quality": options.webp_quality})
+    if options.avif:
+        formats["avif"] = ("AVIF", {"quality": options.avif_quality})
+    results = {}
+    images = []
+    for path in sources:
+        with Image.open(path) as image:
+            image.load()
+            images.append(image.convert("RGB"))
+    for name, spec in formats.items():
+        started = time.perf_counter()
+        total_bytes = 0
+        for image in images:
+            if spec is None:
+                thumbnail = image.copy()
+                thumbnail.thumbnail((options.thumbnail_size, options.thumbnail_size), Image.LANCZOS)
+                data = _encode(thumbnail, "WEBP" if options.webp else "JPEG", quality=options.webp_quality)
+            else:
+                data = _encode(image, spec[0], **spec[1])
+            total_bytes += len(data)
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "msPerImage": round(elapsed / len(images) * 1000, 2),
+            "imagesPerSecond": round(len(images) / elapsed, 2),
+            "avgBytes": round(total_bytes / len(images)),
+        }
+    return results
+
+
+def pipeline(sources, options, workers, tmp_dir):
+    """Full build_image_variants throughput with a pool of ``workers`` processes."""
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    with ProcessPoolExecutor(workers, mp_context=context) as pool:
+        pool.submit(os.getpid).result()
+        started = time.perf_counter()
+        built = list(pool.map(build_image_variants, sources, [tmp_dir] * len(sources), [options] * len(sources)))
+        elapsed = time.perf_counter() - started
+    for files in built:
+        for tmp_path, _, _ in files.values():
+            os.unlink(tmp_path)
+    rate = len(sources) / elapsed
+    return {
+        "workers": workers,
+        "imagesPerSecond": round(rate, 2),
+        "imagesPerSecondPerWorker": round(rate / workers, 2),
+        "elapsedSeconds": round(elapsed, 2),
+    }
+
+
+def main(args):
+    options = detect_options()
+    if options is None or not options.pillow:
+        sys.exit("Pillow is required")
+    work_dir = tempfile.mkdtemp(prefix="transcode-bench-")
+    try:
+        distinct = min(args.images, 8)
+        print(f"Creating {distinct} synthetic {args.size}x{args.size} source images...")
+        paths = []
+        for i in range(distinct):
+            path = os.path.join(work_dir, f"source-{i}.png")
+            make_source(path, args.size, i)
+            paths.append(path)
+        sources = [paths[i % distinct] for i in range(args.images)]
+
+        print(f"Formats: webp={options.webp} avif={options.avif}; {os.cpu_count()} CPUs\n")
+        formats = per_format(paths, options)
+        print(f"{'variant':<10} {'ms/image':>9} {'img/s':>8} {'avg KB':>8}")
+        for name, stats in formats.items():
+            print(f"{name:<10} {stats['msPerImage']:>9.1f} {stats['imagesPerSecond']:>8.2f} {stats['avgBytes'] / 1024:>8.1f}")
+
+        print(f"\nAll variants of {args.images} images:")
+        print(f"{'workers':>7} {'img/s':>8} {'img/s/worker':>13}")
+        pools = []
+        for workers in args.workers:
+            result = pipeline(sources, options, workers, work_dir)
+            pools.append(result)
+            print(f"{workers:>7} {result['imagesPerSecond']:>8.2f} {result['imagesPerSecondPerWorker']:>13.2f}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "config": {
+                "images": args.images,
+                "size": args.size,
+                "thumbnailSize": options.thumbnail_size,
+                "webpQuality": options.webp_quality,
+                "avifQuality": options.avif_quality,
+                "webp": options.webp,
+                "avif": options.avif,
+            },
+            "formats": formats,
+            "pools": pools,
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def parse_workers(spec):
+    return [int(n) for n in spec.split(",")]
+
+
+if __name__ == "__main__":
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1, max(1, cpus // 2), cpus})
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=32, help="Images to transcode per pool size")
+    parser.add_argument("--size", type=int, default=1024, help="Source image width and height")
+    parser.add_argument("--workers", type=parse_workers, default=default_workers,
+                        help="Comma-separated pool sizes to measure, e.g. 1,2,4")
+    parser.add_argument("--output", help="Write machine-readable JSON results to this file")
+    main(parser.parse_args())
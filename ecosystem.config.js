@@ -3,7 +3,7 @@ module.exports = {
     {
       name: 'text-to-image',
       script: 'python',
-      args: '-m uvicorn app.main:app --host 0.0.0.0 --port 3123',
+      args: '-m uvicorn app.main:app --host 0.0.0.0 --port 3123 --no-access-log',
       instances: 1,
       autorestart: true,
       watch: false,
@@ -65,9 +65,15 @@ class MCPClient {
      * Get image status using MCP.
      * 
      * @param {string} imageId - ID of the generated image
+     * @param {number} wait - Seconds the server may hold the request until the
+     *     status changes, instead of answering straight away
      * @returns {Promise<Object>} Dictionary containing the image status
      */
-    async getImageStatus(imageId) {
+    async getImageStatus(imageId, wait = 0) {
+        const args = { imageId };
+        if (wait) {
+            args.wait = wait;
+        }
         const response = await fetch(`${this.baseUrl}/mcp/messages`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
@@ -75,6 +81,32 @@ class MCPClient {
                 method: 'tools/call',
                 params: {
                     name: 'get-image-status',
+                    arguments: args
+                }
+            })
+        });
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        return response.json();
+    }
+
+    /**
+     * Cancel an unfinished image generation and delete the image using MCP.
+     * 
+     * @param {string} imageId - ID of the image to cancel
+     * @returns {Promise<Object>} Dictionary containing the result
+     */
+    async cancelImage(imageId) {
+        const response = await fetch(`${this.baseUrl}/mcp/messages`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                method: 'tools/call',
+                params: {
+                    name: 'cancel-image',
                     arguments: { imageId }
                 }
             })
@@ -222,9 +254,6 @@ async function batchGenerateExample() {
             console.log(`✅ Generated: ${imageId}`);
             console.log(`🔗 URL: ${imageUrl}`);
             
-            // Small delay between requests
-            await new Promise(resolve => setTimeout(resolve, 1000));
-            
         } catch (error) {
             console.error(`❌ Failed to generate image ${i + 1}:`, error.message);
         }
@@ -9,7 +9,6 @@ Use this to integrate image generation into your Python applications.
 
 import requests
 import json
-import time
 from typing import Dict, Any, Optional, List
 import os
 
@@ -63,22 +62,51 @@ class MCPClient:
         response.raise_for_status()
         return response.json()
     
-    def get_image_status(self, image_id: str) -> Dict[str, Any]:
+    def get_image_status(self, image_id: str, wait: float = 0) -> Dict[str, Any]:
         """
         Get image status using MCP.
         
         Args:
             image_id: ID of the generated image
+            wait: Seconds the server may hold the request until the status
+                changes, instead of answering straight away
             
         Returns:
             Dictionary containing the image status
         """
+        arguments = {"imageId": image_id}
+        if wait:
+            arguments["wait"] = wait
         response = self.session.post(
             f"{self.base_url}/mcp/messages",
             json={
                 "method": "tools/call",
                 "params": {
                     "name": "get-image-status",
+                    "arguments": arguments
+                }
+            },
+            timeout=wait + 30 if wait else None
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    def cancel_image(self, image_id: str) -> Dict[str, Any]:
+        """
+        Cancel an unfinished image generation and delete the image using MCP.
+        
+        Args:
+            image_id: ID of the image to cancel
+            
+        Returns:
+            Dictionary containing the result
+        """
+        response = self.session.post(
+            f"{self.base_url}/mcp/messages",
+            json={
+                "method": "tools/call",
+                "params": {
+                    "name": "cancel-image",
                     "arguments": {"imageId": image_id}
                 }
             }
@@ -191,9 +219,6 @@ def batch_generate_example():
             print(f"✅ Generated: {image_id}")
             print(f"🔗 URL: {image_url}")
             
-            # Small delay between requests
-            time.sleep(1)
-            
         except Exception as e:
             print(f"❌ Failed to generate image {i}: {e}")
     
@@ -9,12 +9,13 @@ import os
 # Add the current directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Import the FastAPI app from the app module
-from app.main import app
-
 if __name__ == "__main__":
+    # Imported here rather than at module level: worker processes started by
+    # multiprocessing re-import this script, and must not load the whole app
+    from app.main import app
     import uvicorn
     # Get port from environment variable (Railway sets this)
     port = int(os.getenv("PORT", 3123))
     print(f"Starting server on port {port}")
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # Access records come from AccessLogMiddleware; uvicorn's loggers feed the queue
+    uvicorn.run(app, host="0.0.0.0", port=port, log_config=None, access_log=False)
\ No newline at end of file